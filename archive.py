@@ -0,0 +1,113 @@
+# -*- encoding: utf-8 -*-
+
+from sqlitedb import openDatabase
+
+# Archive of exported claims and comments in a SQLite file, with a FTS5 full-text index on comment text
+# Rows are kept in memory and inserted by batches of batchSize in one transaction
+# Comments exported again (eg. by a later export of the channel) replace the archived ones
+class CommentArchive():
+    def __init__(self, filename, batchSize=5000):
+        self.filename = filename
+        self.batchSize = batchSize
+        self.connection = openDatabase(filename)
+        self.createTables()
+
+        self.claimsRows = []
+        self.commentsRows = []
+
+    def createTables(self):
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS claims (
+                    claim_id TEXT PRIMARY KEY,
+                    channel_id TEXT NOT NULL,
+                    url TEXT,
+                    title TEXT,
+                    release_time INTEGER
+                )""")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS comments (
+                    comment_id TEXT PRIMARY KEY,
+                    parent_id TEXT,
+                    claim_id TEXT NOT NULL,
+                    channel_id TEXT,
+                    channel_title TEXT,
+                    timestamp INTEGER,
+                    text TEXT
+                )""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS comments_claim ON comments (claim_id, timestamp)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS comments_channel ON comments (channel_id, timestamp)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS comments_timestamp ON comments (timestamp)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS claims_channel ON claims (channel_id, release_time)")
+
+            # Full-text index on text, kept in sync with comments by triggers
+            self.connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS comments_fts USING fts5(text, content='comments', content_rowid='rowid')")
+            self.connection.execute("""
+                CREATE TRIGGER IF NOT EXISTS comments_ai AFTER INSERT ON comments BEGIN
+                    INSERT INTO comments_fts (rowid, text) VALUES (new.rowid, new.text);
+                END""")
+            self.connection.execute("""
+                CREATE TRIGGER IF NOT EXISTS comments_ad AFTER DELETE ON comments BEGIN
+                    INSERT INTO comments_fts (comments_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+                END""")
+            self.connection.execute("""
+                CREATE TRIGGER IF NOT EXISTS comments_au AFTER UPDATE ON comments BEGIN
+                    INSERT INTO comments_fts (comments_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+                    INSERT INTO comments_fts (rowid, text) VALUES (new.rowid, new.text);
+                END""")
+
+    def addClaim(self, claim_id, channel_id, url, title, release_time):
+        self.claimsRows.append((claim_id, channel_id, url, title, release_time))
+
+    def addComment(self, comment_id, parent_id, claim_id, channel_id, channel_title, timestamp, text):
+        self.commentsRows.append((comment_id, parent_id, claim_id, channel_id, channel_title, timestamp, text))
+        if len(self.commentsRows) >= self.batchSize:
+            self.flush()
+
+    # Insert rows kept in memory in one transaction
+    def flush(self):
+        if not self.claimsRows and not self.commentsRows:
+            return
+
+        with self.connection:
+            self.connection.executemany("""
+                INSERT INTO claims VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (claim_id) DO UPDATE SET
+                    channel_id = excluded.channel_id, url = excluded.url, title = excluded.title, release_time = excluded.release_time""", self.claimsRows)
+            self.connection.executemany("""
+                INSERT INTO comments VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (comment_id) DO UPDATE SET
+                    parent_id = excluded.parent_id, claim_id = excluded.claim_id, channel_id = excluded.channel_id,
+                    channel_title = excluded.channel_title, timestamp = excluded.timestamp, text = excluded.text""", self.commentsRows)
+        self.claimsRows = []
+        self.commentsRows = []
+
+    # Comments whose text matches a FTS5 query (eg. 'word', '"exact phrase"', 'word*'), best matches first
+    def search(self, query, limit=100):
+        rows = self.connection.execute("""
+            SELECT comments.* FROM comments_fts JOIN comments ON comments.rowid = comments_fts.rowid
+            WHERE comments_fts MATCH ? ORDER BY comments_fts.rank LIMIT ?""", (query, limit))
+
+        return [self.toComment(row) for row in rows]
+
+    # Comments of a commenter's channel, newest first
+    def getChannelComments(self, channel_id, limit=1000):
+        rows = self.connection.execute("SELECT * FROM comments WHERE channel_id = ? ORDER BY timestamp DESC LIMIT ?", (channel_id, limit))
+
+        return [self.toComment(row) for row in rows]
+
+    # Comments of a claim, oldest first
+    def getClaimComments(self, claim_id):
+        rows = self.connection.execute("SELECT * FROM comments WHERE claim_id = ? ORDER BY timestamp", (claim_id,))
+
+        return [self.toComment(row) for row in rows]
+
+    def toComment(self, row):
+        comment_id, parent_id, claim_id, channel_id, channel_title, timestamp, text = row
+
+        return {"comment_id": comment_id, "parent_id": parent_id, "claim_id": claim_id, "channel_id": channel_id,
+                "channel_title": channel_title, "timestamp": timestamp, "text": text}
+
+    def close(self):
+        self.flush()
+        self.connection.close()
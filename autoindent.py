@@ -15,24 +15,43 @@
 #      along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #
 
-from typing import Iterable
+from itertools import islice
+from typing import Iterable, Optional, TextIO
 
 # TODO: add basic separator setup and etc.
 class Indent:
     """Main class for auto indenting"""
     def __str__(self):
-        return self.__output_string[:-1]
+        return self.get_output()
 
-    def __init__(self, basic_str: str = "", separator: str = " ", basic_level: int = 0):
-        """"""
+    def __init__(self, basic_str: str = "", separator: str = " ", basic_level: int = 0,
+                 sink: Optional[TextIO] = None):
+        """With a sink (any object with a write method), lines are written to it as they are added
+        instead of being kept for get_output"""
         self.separator = separator
         self.basic_level = basic_level
+        self.sink = sink
 
         self.__indent_level = 0  # protection from accidental change of main values
-        self.__output_string = basic_str
+        self.__output_parts = [basic_str]  # joined once in get_output instead of concatenated on each add
+        self.__ends_with_line = False  # True when the last part is the newline of an added line
+        self.__indents = {}  # (separator, format_level) -> indent string
+
+    def __get_indent(self, format_level: int) -> str:
+        key = (self.separator, format_level)
+        indent = self.__indents.get(key)
+        if indent is None:
+            indent = self.__indents[key] = self.separator * format_level
+
+        return indent
 
     def __add_to_output_string(self, string: str, indent: str = "") -> None:
-        self.__output_string += f"{indent}{string}\n"
+        if self.sink is not None:
+            self.sink.write(f"{indent}{string}\n")
+            return
+
+        self.__output_parts += (indent, string, "\n")
+        self.__ends_with_line = True
         return
 
     def set_indent_level(self, format_level: int) -> None:
@@ -44,7 +63,7 @@ class Indent:
     def add(self, input_str: str | Iterable[str], format_level: int = 0,
                     increase_formatting_from: int = 0) -> None:
 
-        indent = (self.separator * format_level)
+        indent = self.__get_indent(format_level)
 
         if isinstance(input_str, str):
             if input_str.count("\n") > 0:
@@ -64,11 +83,16 @@ class Indent:
                 self.__add_to_output_string(curr_str, indent)
 
     def get_output(self) -> str:
-        return self.__output_string[:-1]
+        # Output is returned without its last character, which is the newline of the last added line
+        if self.__ends_with_line:
+            return "".join(islice(self.__output_parts, len(self.__output_parts) - 1))
+
+        return "".join(self.__output_parts)[:-1]
 
     def reset_output(self) -> None:
-        self.__output_string = ""
+        self.__output_parts = [""]
+        self.__ends_with_line = False
 
     def replace_output(self, replacement: str) -> None:
         self.reset_output()
-        self.__output_string = replacement
+        self.__output_parts = [replacement]
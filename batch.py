@@ -0,0 +1,120 @@
+# -*- encoding: utf-8 -*-
+
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from zoneinfo import ZoneInfo
+from httpclient import HttpClient
+from channelcache import ChannelCache
+import videos, comment
+
+# Export several channels from one process
+# Channels share one HTTP client, with a global budget of requests in flight, and one cache of commenters' channel titles
+# Retry budgets are per channel, each program gets its own (see HttpClient.share)
+# Each channel gets its own log and result files, as when videos.py or comment.py is launched alone
+class Batch():
+    def __init__(self, channelsFilename, exporter, channelWorkers, maxRequests, tz, dateFormats, programOptions={}, channelCacheFile=None, channelCacheTTL=7 * 24 * 3600, writeMetrics=False):
+        self.channelsFilename = channelsFilename
+        self.exporter = exporter
+        self.channelWorkers = channelWorkers
+        self.tz = tz
+        self.tzinfo = ZoneInfo(tz)
+        self.dateFormats = dateFormats
+        self.programOptions = programOptions
+        self.writeMetrics = writeMetrics
+
+        self.client = HttpClient(maxRequests, maxRequests)
+        self.channelCache = ChannelCache(channelCacheFile, channelCacheTTL)
+        self.loggingLock = threading.Lock()
+
+        self.initLoggingFile()
+
+    def initLoggingFile(self):
+        self.loggingfile = open("batch_" + self.exporter + ".log", "a", encoding="utf-8")
+
+    def writelog(self, message):
+        dateString = datetime.now(self.tzinfo).strftime(self.dateFormats['dateString'])
+        with self.loggingLock:
+            self.loggingfile.write(dateString + " : " + message + "\n")
+            # Write in real time
+            self.loggingfile.flush()
+
+    # Channel claim IDs, one per line, empty lines and lines starting with # are skipped
+    def readChannels(self):
+        idchannels = []
+        with open(self.channelsFilename, "r", encoding="utf-8") as fchannels:
+            for line in fchannels:
+                line = line.strip()
+                if line != "" and not line.startswith("#") and line not in idchannels:
+                    idchannels.append(line)
+
+        return idchannels
+
+    def exportChannel(self, idchannel):
+        try:
+            if self.exporter == "videos":
+                program = videos.Program(idchannel, '', self.programOptions.get('getThumbnail', False), self.tz, self.dateFormats,
+                                         client=self.client, exitProcess=False,
+                                         **{key: value for key, value in self.programOptions.items() if key != 'getThumbnail'})
+            else:
+                program = comment.Program(idchannel, '', self.tz, self.dateFormats, client=self.client, channelCache=self.channelCache, **self.programOptions)
+            program.main()
+        except BaseException as e:
+            # exitProgram already wrote the error in the log file of the channel
+            print(f"[×] channel={idchannel} Export failed : {e!r}")
+            self.writelog(f"[×] channel={idchannel} Export failed : {e!r}")
+            return False
+
+        self.writelog(f"channel={idchannel} Export was OK")
+        return True
+
+    def main(self):
+        print("Starting batch")
+        self.writelog("Starting batch")
+
+        idchannels = self.readChannels()
+        self.writelog(f"{len(idchannels)} channels to export with {self.exporter}")
+
+        self.client.metrics.startPhase("export")
+        with ThreadPoolExecutor(max_workers=self.channelWorkers) as executor:
+            results = list(executor.map(self.exportChannel, idchannels))
+        self.client.metrics.endPhase("export")
+        self.client.metrics.addItems("export", "channels", len(idchannels))
+
+        failedChannels = [idchannel for idchannel, result in zip(idchannels, results) if result is False]
+        print(f"Batch ended : {len(idchannels) - len(failedChannels)} channels OK, {len(failedChannels)} failed")
+        self.writelog(f"Batch ended : {len(idchannels) - len(failedChannels)} channels OK, {len(failedChannels)} failed")
+        for idchannel in failedChannels:
+            self.writelog(f"[×] channel={idchannel} failed")
+
+        # Requests of all channels, the shared client counts them (see metrics.py)
+        if self.writeMetrics is True:
+            self.client.metrics.write("batch_" + self.exporter)
+        self.channelCache.save()
+        self.client.close()
+        self.loggingfile.close()
+
+if __name__ == "__main__":
+    # Channels
+    channelsFilename = 'channels.txt' # One "Claim ID" of channel per line
+    exporter = 'comments' # 'videos' or 'comments'
+
+    # Engine
+    channelWorkers = 4 # Number of channels exported in parallel
+    maxRequests = 32 # Maximum number of requests in flight, all channels together
+    programOptions = {} # Options of videos.Program or comment.Program, eg. {"getThumbnail": False, "useAsync": True} for videos
+
+    # Channel titles of commenters
+    channelCacheFile = None # eg. "channels_cache.json" to reuse channel titles in next runs
+    channelCacheTTL = 7 * 24 * 3600 # Channel titles older than this number of seconds are searched again
+
+    # Metrics
+    writeMetrics = False # True to write requests by endpoint of all channels in batch_<exporter>.metrics.json and .prom, add "writeMetrics": True to programOptions for each channel
+
+    # Format
+    tz = "Europe/Paris"
+    dateFormats = {"dateString": "%d/%m/%Y %H:%M:%S", "dateDBString": "%Y-%m-%d %H:%M:%S", "dateFileString": "%d%m%Y%H%M%S"}
+
+    # Launch
+    batch = Batch(channelsFilename, exporter, channelWorkers, maxRequests, tz, dateFormats, programOptions, channelCacheFile, channelCacheTTL, writeMetrics)
+    batch.main()
@@ -0,0 +1,154 @@
+# -*- encoding: utf-8 -*-
+
+from datetime import datetime
+from urllib.request import urlopen
+import json, multiprocessing, os, queue, resource, sys, tempfile, time
+from mockserver import MockOdysee
+from httpclient import HttpClient
+from cassette import CassettePlayer
+
+# End-to-end throughput of videos.py and comment.py against mockserver.py, without hitting Odysee
+# The mock server and each export run in their own process, so the peak RSS of an export is only its own
+# For each case : requests/s, claims/s, comments/s and peak RSS
+# With a cassette recorded on Odysee (see cassette.py), cases replay its responses instead of asking the mock server
+
+def serve(mockOptions, baseUrls):
+    mock = MockOdysee(**mockOptions)
+    baseUrls.put(mock.start())
+    mock.thread.join()
+
+def getStats(baseUrl):
+    with urlopen(baseUrl + "/__stats") as response:
+        return json.loads(response.read())
+
+# Run one export in this process and report its duration, requests replayed from a cassette and peak RSS
+def runExport(exporter, programOptions, poolSize, baseUrl, cassetteFile, latencyScale, channel_id, workdir, results):
+    os.chdir(workdir)
+    # Exporters print every request and claim, only the cost of formatting is kept
+    sys.stdout = open(os.devnull, "w", encoding="utf-8")
+
+    tz = "Europe/Paris"
+    dateFormats = {"dateString": "%d/%m/%Y %H:%M:%S", "dateDBString": "%Y-%m-%d %H:%M:%S", "dateFileString": "%d%m%Y%H%M%S"}
+    player = CassettePlayer(cassetteFile, latencyScale) if cassetteFile is not None else None
+    client = HttpClient(poolSize, baseUrl=baseUrl, cassette=player)
+
+    start = time.perf_counter()
+    if exporter == "videos":
+        import videos
+        program = videos.Program(channel_id, "", False, tz, dateFormats, client=client, exitProcess=False, **programOptions)
+    else:
+        import comment
+        program = comment.Program(channel_id, "", tz, dateFormats, client=client, **programOptions)
+    program.main()
+    elapsed = time.perf_counter() - start
+    client.close()
+
+    # ru_maxrss is in KiB on Linux
+    results.put({"elapsed": elapsed, "requests": player.count if player is not None else None, "peakRSS": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024})
+
+class Benchmark():
+    # channel_id is the channel of the cassette, the mock server gives its own
+    def __init__(self, mockOptions, cases, poolSize=20, cassetteFile=None, latencyScale=1.0, channel_id=None):
+        self.mockOptions = mockOptions
+        self.cases = cases
+        self.poolSize = poolSize
+        self.cassetteFile = cassetteFile
+        self.latencyScale = latencyScale
+        self.channel_id = channel_id
+        self.baseUrl = None
+        # Exports start from a fresh interpreter, their RSS doesn't include the benchmark's
+        self.context = multiprocessing.get_context("spawn")
+
+    def startServer(self):
+        baseUrls = self.context.Queue()
+        self.server = self.context.Process(target=serve, args=(self.mockOptions, baseUrls), daemon=True)
+        self.server.start()
+        self.baseUrl = baseUrls.get()
+
+        stats = getStats(self.baseUrl)
+        self.channel_id = next(iter(stats['channels']))
+        self.channelSize = stats['channels'][self.channel_id]
+
+    def runCase(self, name, exporter, programOptions):
+        if self.cassetteFile is None:
+            requestsBefore = sum(getStats(self.baseUrl)['requests'].values())
+        results = self.context.Queue()
+        with tempfile.TemporaryDirectory() as workdir:
+            process = self.context.Process(target=runExport, args=(exporter, programOptions, self.poolSize, self.baseUrl, self.cassetteFile, self.latencyScale, self.channel_id, workdir, results))
+            process.start()
+            process.join()
+            try:
+                result = results.get(timeout=5)
+            except queue.Empty:
+                print(f"[×] {name} failed (exit code {process.exitcode})")
+                return None
+        if self.cassetteFile is None:
+            requests = sum(getStats(self.baseUrl)['requests'].values()) - requestsBefore
+        else:
+            requests = result['requests']
+
+        elapsed = result['elapsed']
+        report = {
+            "case": name,
+            "seconds": round(elapsed, 3),
+            "requests": requests,
+            "requestsPerSecond": round(requests / elapsed, 1),
+            "claimsPerSecond": round(self.channelSize['claims'] / elapsed, 1),
+            "commentsPerSecond": round(self.channelSize['comments'] / elapsed, 1) if exporter == "comment" else None,
+            "peakRSSMiB": round(result['peakRSS'] / (1024 * 1024), 1)
+        }
+        print(f"{name:<24} {report['seconds']:>9.2f}s {requests:>9} req {report['requestsPerSecond']:>9.1f} req/s {report['claimsPerSecond']:>9.1f} claims/s "
+              f"{report['commentsPerSecond'] if report['commentsPerSecond'] is not None else '-':>10} comments/s {report['peakRSSMiB']:>8.1f} MiB")
+
+        return report
+
+    def main(self):
+        if self.cassetteFile is None:
+            self.startServer()
+            print(f"Mock channel {self.channel_id} : {self.channelSize['claims']} claims, {self.channelSize['comments']} comments")
+        else:
+            self.channelSize = CassettePlayer(self.cassetteFile).getStats()
+            print(f"Cassette {self.cassetteFile} of channel {self.channel_id} : {self.channelSize['claims']} claims, {self.channelSize['comments']} comments")
+        reports = []
+        try:
+            for name, exporter, programOptions in self.cases:
+                report = self.runCase(name, exporter, programOptions)
+                if report is not None:
+                    reports.append(report)
+        finally:
+            if self.cassetteFile is None:
+                self.server.terminate()
+
+        resultfilename = "benchmark_" + datetime.now().strftime("%d%m%Y%H%M%S") + ".json"
+        with open(resultfilename, "w", encoding="utf-8") as fresult:
+            json.dump({"mock": self.mockOptions if self.cassetteFile is None else None, "cassette": self.cassetteFile, "channel": self.channelSize, "results": reports}, fresult, indent=2)
+        print("Results written in " + resultfilename)
+
+        return reports
+
+if __name__ == "__main__":
+    # Synthetic channel
+    mockOptions = {
+        "claimsPerChannel": 10000,
+        "repostRatio": 0.1,
+        "commentsPerChannel": 1000000,
+        "replyRatio": 0.6,
+        "latency": 0.0, # Seconds added to each response, eg. 0.05 to get closer to Odysee
+        "latencyJitter": 0.0,
+        "errorRate": 0.0 # eg. 0.01 to measure the cost of retries
+    }
+
+    # Cases : name, exporter ("videos" or "comment"), options of Program
+    cases = [
+        ("videos", "videos", {}),
+        ("videos useAsync", "videos", {"useAsync": True}),
+        ("comment", "comment", {}),
+    ]
+    poolSize = 20 # Connections of the HTTP client of each export
+
+    # Cassette, instead of the mock server
+    cassetteFile = None # eg. "comments.cassette.gz" recorded by comment.py, cases must use the exporter that recorded it
+    latencyScale = 1.0 # Replayed responses wait their recorded latency multiplied by latencyScale, 0 to not wait
+    channel_id = '' # Channel of the cassette
+
+    Benchmark(mockOptions, cases, poolSize, cassetteFile, latencyScale, channel_id if cassetteFile is not None else None).main()
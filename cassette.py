@@ -0,0 +1,124 @@
+# -*- encoding: utf-8 -*-
+
+from collections import deque
+from urllib.parse import urlencode
+import base64, gzip, json, threading, time
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# Record the requests of a run and their responses in a cassette (gzipped JSON lines), to replay them later without network
+# A request is identified by its method, url and body : replayed runs get the responses of identical requests in the order they were recorded,
+# whatever the order the engine sends them in
+
+class CassetteMiss(requests.RequestException):
+    pass
+
+def getKey(method, url, kwargs):
+    data = kwargs.get('data')
+    if isinstance(data, dict):
+        data = urlencode(sorted(data.items()))
+    body = json.dumps(kwargs['json'], sort_keys=True) if kwargs.get('json') is not None else data
+
+    return method + " " + url + " " + (body or "")
+
+class CassetteRecorder():
+    replaying = False
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.file = gzip.open(filename, "wt", encoding="utf-8")
+        self.count = 0
+
+    # elapsed is the time the server took to answer, in seconds
+    def record(self, method, url, kwargs, response, elapsed):
+        content = response.content
+        try:
+            body = {"text": content.decode("utf-8")}
+        except UnicodeDecodeError:
+            body = {"base64": base64.b64encode(content).decode("ascii")}
+        entry = {"key": getKey(method, url, kwargs), "status": response.status_code, "headers": dict(response.headers), "elapsed": round(elapsed, 4)}
+        entry.update(body)
+
+        line = json.dumps(entry, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line)
+            self.file.write("\n")
+            self.count = self.count + 1
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+class CassettePlayer():
+    replaying = True
+
+    # Each replayed response waits its recorded elapsed time multiplied by latencyScale (0 for no wait)
+    def __init__(self, filename, latencyScale=1.0):
+        self.filename = filename
+        self.latencyScale = latencyScale
+        self.lock = threading.Lock()
+        self.entries = {}      # key -> recorded entries not replayed yet, in order of recording
+        self.count = 0         # Number of responses replayed
+        self.load()
+
+    def load(self):
+        with gzip.open(self.filename, "rt", encoding="utf-8") as fcassette:
+            try:
+                for line in fcassette:
+                    entry = json.loads(line)
+                    self.entries.setdefault(entry['key'], deque()).append(entry)
+            except (EOFError, json.JSONDecodeError):
+                # Cassette of a run that was killed, the entries written until then are kept
+                pass
+
+    def play(self, method, url, kwargs):
+        key = getKey(method, url, kwargs)
+        with self.lock:
+            recorded = self.entries.get(key)
+            if not recorded:
+                raise CassetteMiss("No recorded response for " + key[:300])
+            entry = recorded.popleft()
+            self.count = self.count + 1
+
+        if self.latencyScale > 0:
+            time.sleep(entry['elapsed'] * self.latencyScale)
+
+        response = requests.models.Response()
+        response.status_code = entry['status']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response._content = entry['text'].encode("utf-8") if 'text' in entry else base64.b64decode(entry['base64'])
+        # Content is already decoded by the recording session
+        response.headers.pop('Content-Encoding', None)
+        response.encoding = "utf-8"
+        response.url = url
+        response.reason = ""
+
+        return response
+
+    # Claims and comments in the recorded responses, to report claims/s and comments/s of replayed runs (before responses are replayed)
+    def getStats(self):
+        claim_ids = set()
+        comment_ids = set()
+        for key, recorded in self.entries.items():
+            for entry in recorded:
+                if entry['status'] != 200 or 'text' not in entry:
+                    continue
+                if "m=claim_search" in key and '"channel_ids"' in key:
+                    claim_ids.update(item['claim_id'] for item in json.loads(entry['text']).get('result', {}).get('items', []))
+                elif "m=comment.List" in key:
+                    comment_ids.update(item['comment_id'] for item in json.loads(entry['text']).get('result', {}).get('items', []))
+
+        return {"claims": len(claim_ids), "comments": len(comment_ids)}
+
+    def close(self):
+        pass
+
+# Recorder of the run with mode "record", player of a recorded run with mode "replay"
+def openCassette(filename, mode, latencyScale=1.0):
+    if mode == "record":
+        return CassetteRecorder(filename)
+    if mode == "replay":
+        return CassettePlayer(filename, latencyScale)
+
+    raise ValueError(f"Unknown cassette mode {mode}, expected record or replay")
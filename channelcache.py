@@ -0,0 +1,67 @@
+# -*- encoding: utf-8 -*-
+
+import json, os, threading, time
+
+# Titles of commenters' channels, shared by all videos of a run so each channel is searched only once
+# With a filename, titles are also kept on disk and reused by later runs until they are older than ttl seconds
+class ChannelCache():
+    def __init__(self, filename=None, ttl=7 * 24 * 3600):
+        self.filename = filename
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+        self.seen = set()       # channel_ids already searched, found or not
+        self.titles = {}        # channel_id -> title, only for channel_ids found by claim_search
+        self.fetchedAt = {}     # channel_id -> timestamp of the search
+
+        if self.filename is not None:
+            self.load()
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+
+        with open(self.filename, "r", encoding="utf-8") as fcache:
+            entries = json.load(fcache)
+
+        now = time.time()
+        for channel_id, entry in entries.items():
+            # Expired entries are searched again
+            if now - entry['fetchedAt'] > self.ttl:
+                continue
+            self.seen.add(channel_id)
+            self.fetchedAt[channel_id] = entry['fetchedAt']
+            if entry['found'] is True:
+                self.titles[channel_id] = entry['title']
+
+    def save(self):
+        if self.filename is None:
+            return
+
+        with self.lock:
+            entries = {}
+            for channel_id in self.seen:
+                entries[channel_id] = {"found": channel_id in self.titles, "title": self.titles.get(channel_id), "fetchedAt": self.fetchedAt[channel_id]}
+
+        # Write a temporary file and replace, a crash while saving doesn't lose the previous cache
+        tmpfilename = self.filename + "." + str(threading.get_ident()) + ".tmp"
+        with open(tmpfilename, "w", encoding="utf-8") as fcache:
+            json.dump(entries, fcache)
+        os.replace(tmpfilename, self.filename)
+
+    # channel_ids not searched yet, in a stable order
+    def unseen(self, channel_ids):
+        with self.lock:
+            return sorted(set(channel_ids) - self.seen)
+
+    # titles : channel_id -> title for channel_ids found among searched channel_ids
+    def update(self, channel_ids, titles):
+        now = time.time()
+        with self.lock:
+            for channel_id in channel_ids:
+                self.seen.add(channel_id)
+                self.fetchedAt[channel_id] = now
+            self.titles.update(titles)
+
+    def get(self, channel_id, default=None):
+        return self.titles.get(channel_id, default)
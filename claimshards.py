@@ -0,0 +1,111 @@
+# -*- encoding: utf-8 -*-
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Enumerate the claims of a very large channel by release_time ranges (shards) fetched in parallel
+# getPage(page, release_time) returns the "result" of a claim_search call ordered by release_time, restricted to the release_time constraints
+# A range with more than maxPagesPerShard pages is split in two, so deep pagination is never needed
+# Pages are yielded in release order (newest first, as claim_search) and a claim_id is yielded only once
+# onError is called when getting a page failed, by default the error is raised again
+# Pages yielded before startPage aren't fetched (eg. they were handled by an interrupted export), only the first page of each shard is
+class ShardedClaimLister():
+    def __init__(self, getPage, workers=4, maxPagesPerShard=20, onError=None, startPage=1):
+        self.getPage = getPage
+        self.workers = workers
+        self.maxPagesPerShard = maxPagesPerShard
+        self.onError = onError
+        self.startPage = startPage
+
+    def getResult(self, future):
+        try:
+            return future.result()
+        except BaseException:
+            if self.onError is not None:
+                self.onError()
+            raise
+
+    # The newest shard has no upper bound (highest is None), so claims released in the future (eg. scheduled or premieres) are listed too
+    def getShardPage(self, shard, page):
+        lowest, highest = shard
+        if highest is None:
+            return self.getPage(page, [">=" + str(lowest)])
+        return self.getPage(page, [">=" + str(lowest), "<" + str(highest)])
+
+    # Split the channel history until each shard fits in maxPagesPerShard pages
+    # Return [(shard, first page result)] in release order
+    def findShards(self, executor):
+        shards = []
+        history = (0, None)
+        probes = {executor.submit(self.getShardPage, history, 1): history}
+        while probes:
+            done, _ = wait(probes, return_when=FIRST_COMPLETED)
+            for probe in done:
+                shard = probes.pop(probe)
+                result = self.getResult(probe)
+                lowest, highest = shard
+                total_pages = result.get('total_pages') or 0
+                if total_pages == 0:
+                    continue
+                # The newest shard is bisected up to its newest claim, first item of its first page
+                upper = highest if highest is not None else getReleaseTime(result.get('items')[0]) + 1
+                if total_pages <= self.maxPagesPerShard or upper - lowest <= 1:
+                    shards.append((shard, result))
+                    continue
+
+                # Too dense, bisect the range
+                middle = (lowest + upper) // 2
+                for half in ((lowest, middle), (middle, highest)):
+                    probes[executor.submit(self.getShardPage, half, 1)] = half
+
+        # Newest range first
+        shards.sort(key=lambda shardResult: shardResult[0][0], reverse=True)
+
+        return shards
+
+    def iterPages(self, executor):
+        shards = self.findShards(executor)
+
+        # Remaining pages of every shard, in release order
+        remaining = deque()
+        for shard, result in shards:
+            # First page was fetched by findShards
+            firstPage = Future()
+            firstPage.set_result(result)
+            remaining.append((firstPage, None))
+            for page in range(2, (result.get('total_pages') or 0) + 1):
+                remaining.append((shard, page))
+        for _ in range(min(self.startPage - 1, len(remaining))):
+            remaining.popleft()
+
+        # Keep a few pages in flight ahead of the consumer
+        pending = deque()
+        seen = set()
+        while remaining or pending:
+            while remaining and len(pending) < self.workers * 2:
+                entry, page = remaining.popleft()
+                if page is None:
+                    pending.append(entry)
+                else:
+                    pending.append(executor.submit(self.getShardPage, entry, page))
+
+            result = self.getResult(pending.popleft())
+
+            # Claims on a shard boundary or moved during the enumeration are skipped the second time
+            items = []
+            for item in result.get('items', []):
+                if item.get('claim_id') not in seen:
+                    seen.add(item.get('claim_id'))
+                    items.append(item)
+            yield {"items": items}
+
+    def __iter__(self):
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            yield from self.iterPages(executor)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+# Claims without release_time are ordered by their timestamp
+def getReleaseTime(item):
+    return int(item.get('release_time', item.get('timestamp')))
@@ -2,32 +2,241 @@
 
 from datetime import datetime
 import dateutil.parser
-import sys, threading
-import requests, json
+import os, sys, threading, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+from httpclient import HttpClient
+from channelcache import ChannelCache
+from syncstate import CommentSyncState
+from prefetch import PagePrefetcher
+from claimshards import ShardedClaimLister, getReleaseTime
 from autoindent import Indent
+from exporters import openExporters
+from archive import CommentArchive
+from cassette import openCassette
+from metrics import Metrics
+from profiling import Profiler
+import sqlite3
 from zoneinfo import ZoneInfo
 
 # Note : autoindent package is https://github.com/ANoneTypeOn/autoindent/blob/master/autoindent.py // but change small things
 
+# Assemble comment threads across comment.List pages
+# A reply whose parent is on a later page waits for it, a root thread is released as soon as all its replies are attached
+# Only comments of threads still open are kept in memory
+class ThreadAssembler():
+    def __init__(self):
+        self.nodes = {}           # comment_id -> comment, for comments of open threads
+        self.top_of = {}          # comment_id -> comment_id of the top of its subtree (union-find)
+        self.missing = {}         # top comment_id -> number of replies not received yet in the subtree
+        self.waiting = {}         # parent_id -> subtrees received before their parent
+        self.pending_roots = {}   # root comment_id -> root comment, in order of arrival
+        self.arrival = {}         # comment_id -> order of arrival, for comments of open threads
+        self.arrived = 0          # number of comments added
+
+    def find_top(self, comment_id):
+        top = comment_id
+        while self.top_of[top] != top:
+            top = self.top_of[top]
+        # Path compression
+        while self.top_of[comment_id] != top:
+            self.top_of[comment_id], comment_id = top, self.top_of[comment_id]
+        return top
+
+    def add_comment(self, comment):
+        comment_id = comment["comment_id"]
+        comment["sub_replies"] = []
+        self.nodes[comment_id] = comment
+        self.top_of[comment_id] = comment_id
+        self.arrival[comment_id] = self.arrived
+        self.arrived = self.arrived + 1
+        # "replies" is the number of direct replies of a comment
+        missing = comment.get("replies", 0)
+
+        # Adopt the subtrees that were waiting for this comment
+        for child in self.waiting.pop(comment_id, []):
+            comment["sub_replies"].append(child)
+            missing += self.missing.pop(child["comment_id"]) - 1
+            self.top_of[child["comment_id"]] = comment_id
+        self.missing[comment_id] = missing
+
+        if "parent_id" not in comment:
+            self.pending_roots[comment_id] = comment
+        elif comment["parent_id"] in self.nodes:
+            parent_id = comment["parent_id"]
+            self.nodes[parent_id]["sub_replies"].append(comment)
+            top = self.find_top(parent_id)
+            self.missing[top] += self.missing.pop(comment_id) - 1
+            self.top_of[comment_id] = top
+        else:
+            self.waiting.setdefault(comment["parent_id"], []).append(comment)
+
+    def release(self, root):
+        stack = [root]
+        while stack:
+            comment = stack.pop()
+            del self.nodes[comment["comment_id"]]
+            del self.top_of[comment["comment_id"]]
+            del self.arrival[comment["comment_id"]]
+            stack.extend(comment["sub_replies"])
+        del self.missing[root["comment_id"]]
+        del self.pending_roots[root["comment_id"]]
+
+    # Add a page of comments and return the root threads completed, in order of arrival
+    def add_page(self, comments):
+        for comment in comments:
+            self.add_comment(comment)
+
+        complete_roots = [root for root_id, root in self.pending_roots.items() if self.missing[root_id] <= 0]
+        for root in complete_roots:
+            self.release(root)
+
+        return complete_roots
+
+    # Comments of open threads, in order of arrival and without their sub_replies, to be saved in a checkpoint
+    # Adding them again in this order rebuilds the same threads, the state stays flat however deep threads are
+    def get_state(self):
+        comments = sorted(self.nodes.values(), key=lambda comment: self.arrival[comment["comment_id"]])
+
+        return [{key: value for key, value in comment.items() if key != "sub_replies"} for comment in comments]
+
+    @classmethod
+    def from_state(cls, state):
+        assembler = cls()
+        for comment in state:
+            assembler.add_comment(comment)
+
+        return assembler
+
+    # Return the root threads still open after the last page (eg. some replies were deleted), in order of arrival
+    # Replies whose parent never came are dropped, as when a page is arranged alone
+    def finish(self):
+        roots = list(self.pending_roots.values())
+        self.__init__()
+
+        return roots
+
+# Fields of the records of outputFormats, one record per comment
+# depth is 0 for root comments, replies written as threads of their own in incremental exports start again at 0
+COMMENT_FIELDS = ["claim_id", "comment_id", "parent_id", "depth", "timestamp", "date", "channel_id", "channel_name", "comment"]
+
 class Program():
-    def __init__(self, idchannel, handlechannel, tz, dateFormats):
+    def __init__(self, idchannel, handlechannel, tz, dateFormats, client=None, channelCache=None, commentsWorkers=4, prefetchPages=2, shardClaims=False, shardWorkers=4, checkpointing=True, checkpointInterval=30, resume=False, incremental=False, probeSize=20, outputFormats=(), archiveFile=None, cassette=None, writeMetrics=False, profile=False):
         self.idchannel = idchannel
         self.handlechannel = handlechannel
+        self.commentsWorkers = commentsWorkers
+        self.prefetchPages = prefetchPages
+        self.shardClaims = shardClaims
+        self.shardWorkers = shardWorkers
+        self.checkpointing = checkpointing
+        self.checkpointInterval = checkpointInterval
+        self.lastCheckpoint = time.monotonic()
+        self.resume = resume
+        self.incremental = incremental
+        self.probeSize = probeSize
+        self.outputFormats = outputFormats
+        self.writeMetrics = writeMetrics
+        self.profile = profile
+        # Phases are only profiled once main started the profiler, when profile is True
+        self.profiler = Profiler()
+        self.commentsExecutor = ThreadPoolExecutor(max_workers=commentsWorkers)
+        self.initClient(client, commentsWorkers, cassette)
+        self.channelCache = ChannelCache() if channelCache is None else channelCache
         self.tzinfo = ZoneInfo(tz)
         self.dateFormats = dateFormats
+        # Only comments newer than the last export are fetched in incremental mode
+        self.syncState = CommentSyncState("comments_" + self.idchannel + ".state") if incremental is True else None
         
         self.initLoggingFile()
         self.initResultFile()
+        # Claims written before the checkpoint keep the state they had when it was written
+        if self.syncState is not None and self.checkpoint is not None and self.checkpoint.get('syncState') is not None:
+            self.syncState.restoreUpdates(self.checkpoint['syncState'])
+        # Claims and comments are also archived in a SQLite file with a full-text index when archiveFile is set
+        self.archive = CommentArchive(archiveFile) if archiveFile is not None else None
             
+    # client can be shared between several programs, otherwise a new one is created with a pool sized to the concurrency
+    # A shared client gives the program its own retry budgets (see HttpClient.share)
+    # cassette (see cassette.py) records the requests of the new client, or replays recorded ones
+    # Requests of a shared client are counted in the metrics of the client owner (eg. batch.py), the program only keeps its phases
+    def initClient(self, client, poolSize, cassette=None):
+        self.ownClient = client is None
+        self.client = HttpClient(poolSize, cassette=cassette) if client is None else client.share()
+        self.metrics = self.client.metrics if self.ownClient is True else Metrics()
+
     def initLoggingFile(self):
         loggingfilename = "comments_" + self.idchannel
         self.loggingfile = open(loggingfilename + ".log", "a", encoding="utf-8")
     
     def initResultFile(self):
-        dateNow = self.getDateNow()
-        resultfilename = "comments_" + self.idchannel + "_" + dateNow['dateFileString'] +  ".txt"
-        self.resultfile = open(resultfilename, "w", encoding="utf-8")
+        self.checkpointfilename = "comments_" + self.idchannel + ".checkpoint"
+        self.checkpoint = self.loadCheckpoint() if self.resume is True else None
+
+        if self.checkpoint is not None:
+            # Continue the result file of the interrupted export, without what was written after the last checkpoint
+            resultfilename = self.checkpoint['resultfilename']
+            os.truncate(resultfilename, self.checkpoint['resultOffset'])
+            mode = "a"
+        else:
+            dateNow = self.getDateNow()
+            resultfilename = "comments_" + self.idchannel + "_" + dateNow['dateFileString'] +  ".txt"
+            mode = "w"
+
+        self.resultfilename = resultfilename
+        # Large buffer, the result file is written line by line
+        self.resultfile = open(resultfilename, mode, encoding="utf-8", buffering=1024 * 1024)
+        # Comment lines are indented straight into the result file
+        self.commentsIndent = Indent(sink=self.resultfile)
+        # Structured outputs next to the result file (eg. comments_<idchannel>_<date>.ndjson)
+        exportOffsets = self.checkpoint['exportOffsets'] if self.checkpoint is not None else None
+        self.exporters = openExporters(resultfilename[:-len(".txt")], self.outputFormats, COMMENT_FIELDS, exportOffsets)
     
+    def loadCheckpoint(self):
+        if not os.path.exists(self.checkpointfilename):
+            return None
+
+        with open(self.checkpointfilename, "r", encoding="utf-8") as fcheckpoint:
+            return json.load(fcheckpoint)
+
+    # Record the last claim page, claim (claim_id and release_time) and comment page fully written
+    # commentPage is None when all comments of the claim are written, otherwise threadAssembler holds the threads still open
+    # The result file is synced first, so the checkpoint never points after what is on disk
+    # Syncing costs more than writing a page, a checkpoint is written at most every checkpointInterval seconds
+    def writeCheckpoint(self, claimPage, item, commentPage, threadAssembler):
+        if self.checkpointing is False or time.monotonic() - self.lastCheckpoint < self.checkpointInterval:
+            return
+
+        with self.profiler.phase("write"):
+            self.resultfile.flush()
+            os.fsync(self.resultfile.fileno())
+            # Archived rows of what was written are committed too, a resumed export doesn't write them again
+            self.flushArchive()
+
+            checkpoint = {
+                "resultfilename": self.resultfilename,
+                "resultOffset": os.fstat(self.resultfile.fileno()).st_size,
+                "exportOffsets": {outputFormat: exporter.sync() for outputFormat, exporter in self.exporters.items()},
+                "claimPage": claimPage,
+                "claim_id": item.get('claim_id'),
+                "release_time": getReleaseTime(item),
+                "commentPage": commentPage,
+                "threads": threadAssembler.get_state() if threadAssembler is not None else None,
+                # States of claims updated so far by an incremental export, the state file is only saved when the export is complete
+                "syncState": self.syncState.getUpdates() if self.syncState is not None else None
+            }
+            tmpfilename = self.checkpointfilename + ".tmp"
+            with open(tmpfilename, "w", encoding="utf-8") as fcheckpoint:
+                json.dump(checkpoint, fcheckpoint)
+                fcheckpoint.flush()
+                os.fsync(fcheckpoint.fileno())
+            os.replace(tmpfilename, self.checkpointfilename)
+        self.lastCheckpoint = time.monotonic()
+
+    def removeCheckpoint(self):
+        if os.path.exists(self.checkpointfilename):
+            os.remove(self.checkpointfilename)
+
     def getDateNow(self):
         timestamp_now = datetime.now().timestamp()
         date = datetime.fromtimestamp(timestamp_now, self.tzinfo)
@@ -39,9 +248,10 @@ class Program():
         
         return dateNow
 
+    # Only dateString is needed, the other formats of getDateNow aren't computed for each line
     def writelog(self, message):
-        dateNow = self.getDateNow()
-        self.loggingfile.write(dateNow["dateString"] + " : " + message + "\n")
+        dateString = datetime.now(self.tzinfo).strftime(self.dateFormats['dateString'])
+        self.loggingfile.write(dateString + " : " + message + "\n")
         # Write in real time
         self.loggingfile.flush()
             
@@ -66,7 +276,7 @@ class Program():
         }
         print(channelInfosURL)
         try:
-            response = requests.post(channelInfosURL, json=data, headers=headers)
+            response = self.client.post(channelInfosURL, json=data, headers=headers)
             if response.status_code == 200:
                 channelInfosResponse = response.text
                 channel_json = json.loads(channelInfosResponse)       
@@ -94,6 +304,10 @@ class Program():
 
     # Used when errors/exceptions occured and when we want to exit right now
     def exitProgram(self):
+        # In a background thread, only the thread is stopped : the thread running main gets the error and exits the program
+        if threading.current_thread() is not self.mainThread:
+            raise SystemExit(1)
+
         self.writelog("Execution had errors")
         self.writelog("Ending program")
         self.clean()
@@ -102,15 +316,42 @@ class Program():
     # Used at the end of program without errors/exceptions and when errors/exception occured
     def clean(self):
         try:
+            # Metrics of the run (see metrics.py) next to the result file, eg. comments_<idchannel>_<date>.metrics.json and .prom
+            if self.writeMetrics is True:
+                self.metrics.write(self.resultfilename[:-len(".txt")])
+            # CPU and allocations of each phase (see profiling.py), eg. comments_<idchannel>_<date>.profile.txt
+            if self.profile is True:
+                self.profiler.stop()
+                self.profiler.write(self.resultfilename[:-len(".txt")])
             # Close Files
             self.loggingfile.close()
             self.resultfile.close()
+            for exporter in self.exporters.values():
+                exporter.close()
+            if self.archive is not None:
+                self.archive.close()
+            # Keep channel titles for next runs when channelCache has a file
+            self.channelCache.save()
+            # Don't start pages that are still queued
+            self.commentsExecutor.shutdown(wait=False, cancel_futures=True)
+            # Close connections only if the client isn't shared with other programs
+            if self.ownClient is True:
+                self.client.close()
         except Exception as e:
             print("Error cleaning up : " + str(e))
             
-    def getComments(self, claim_id, page):
-        comments = None
-        
+    def getComments(self, claim_id, page, pageSize=999):
+        commentsResponse = self.getCommentsResponse(claim_id, page, pageSize)
+        if commentsResponse is None:
+            return None
+
+        return self.decodeComments(claim_id, page, commentsResponse)
+
+    # Body of the comment.List response of a page, None when the request failed
+    # Pages fetched by commentsWorkers threads are decoded by the thread running main, so the profiler sees their decoding in the fetch phase
+    def getCommentsResponse(self, claim_id, page, pageSize=999):
+        commentsResponse = None
+
         commentsURL = 'https://comments.odysee.tv/api/v2?m=comment.List'
         headers = {"Content-Type": "application/json", "Origin": "https://odysee.com", "Referer": "https://odysee.com"}
         data = {
@@ -120,7 +361,7 @@ class Program():
               "params": {
                 "page": page,
                 "claim_id": claim_id,
-                "page_size": 999, # automatically set to 600 in response
+                "page_size": pageSize, # automatically set to 600 in response when bigger
                 "top_level": False,
                 "sort_by": 0
               }
@@ -128,17 +369,9 @@ class Program():
         print(commentsURL)
         print(data)
         try:
-            response = requests.post(commentsURL, json=data, headers=headers)
+            response = self.client.post(commentsURL, json=data, headers=headers)
             if response.status_code == 200:
                 commentsResponse = response.text
-                comments_json = json.loads(commentsResponse)
-                result = comments_json.get('result')
-                if 'error' in comments_json:
-                    print(f"[×] claim_id={claim_id} Error getting comment.List commentsURL={commentsURL} data={data} : {comments_json['error']['message']}")
-                    self.writelog(f"[×] claim_id={claim_id} Error getting comment.List commentsURL={commentsURL} data={data} : {comments_json['error']['message']}")
-                else:
-                    # Sometimes 'items' key is missing in result
-                    comments = result
             else:
                 print(f"[×] claim_id={claim_id} Response of commentsURL {commentsURL} isn't OK : {response.status_code} {response.text}")
                 self.writelog(f"[×] claim_id={claim_id} Response of commentsURL {commentsURL} isn't OK : {response.status_code} {response.text}")
@@ -146,7 +379,52 @@ class Program():
             print(f"[×] claim_id={claim_id} Error commentsURL {commentsURL} : {e}")
             self.writelog(f"[×] claim_id={claim_id} Error commentsURL {commentsURL} : {e}")
 
-        return comments  
+        return commentsResponse
+
+    # "result" of a comment.List response, None when it is an error
+    def decodeComments(self, claim_id, page, commentsResponse):
+        comments = None
+
+        try:
+            comments_json = json.loads(commentsResponse)
+            result = comments_json.get('result')
+            if 'error' in comments_json:
+                print(f"[×] claim_id={claim_id} Error getting comment.List page={page} : {comments_json['error']['message']}")
+                self.writelog(f"[×] claim_id={claim_id} Error getting comment.List page={page} : {comments_json['error']['message']}")
+            else:
+                # Sometimes 'items' key is missing in result
+                comments = result
+        except Exception as e:
+            print(f"[×] claim_id={claim_id} Error decoding comment.List page={page} : {e}")
+            self.writelog(f"[×] claim_id={claim_id} Error decoding comment.List page={page} : {e}")
+
+        return comments
+
+    # Yield (page, comment.List page) of a claim in page order, from startPage
+    # Once the first page gives total_pages, the other pages are fetched by commentsWorkers threads, at most commentsWorkers pages ahead of the caller
+    def iterCommentsPages(self, claim_id, startPage=1):
+        commentsRequest = self.getComments(claim_id, startPage)
+        if commentsRequest is None:
+            self.exitProgram()
+        yield startPage, commentsRequest
+
+        total_pagesComments = commentsRequest['total_pages']
+        pageComments = startPage + 1
+        pageYielded = startPage
+        pendingPages = deque()
+        while pageComments <= total_pagesComments or pendingPages:
+            while pageComments <= total_pagesComments and len(pendingPages) < self.commentsWorkers:
+                pendingPages.append(self.commentsExecutor.submit(self.getCommentsResponse, claim_id, pageComments))
+                pageComments = pageComments + 1
+
+            pageYielded = pageYielded + 1
+            commentsResponse = pendingPages.popleft().result()
+            if commentsResponse is None:
+                self.exitProgram()
+            commentsRequest = self.decodeComments(claim_id, pageYielded, commentsResponse)
+            if commentsRequest is None:
+                self.exitProgram()
+            yield pageYielded, commentsRequest
 
     # Add a new key for each comment on the list for sub replies
     def augment_replies(self, base_comments):
@@ -158,122 +436,131 @@ class Program():
             
         return augmented_comments
 
-    # Find the replies belonging to base_comments
-    def find_replies(self, all_replies, base_comments):
-        lvl_comment = []
-        
-        for rep in all_replies:
-            for base in base_comments:
-                if rep["parent_id"] == base["comment_id"]:
-                    # Each reply may have more sub-replies.
-                    # We allocate the space for them.
-                    rep["sub_replies"] = []
-                    lvl_comment.append(rep)
-
-        return lvl_comment
-
-    # Arrange raw comments list to a list of comments with their replies
-    def arrange_comments(self, comments):
-        root_comments = []
-        all_replies = []
-        channel_ids = []
-        channel_infos = {}
-        
-        for comment in comments:
-            if "parent_id" in comment:
-                all_replies.append(comment)
-            else:
-                root_comments.append(comment)
-
-            if comment['channel_id'] not in channel_ids:
-                channel_ids.append(comment['channel_id'])
-        
-        # Search channel_title for each channel that comments
-        # Can be optimized if I make only one call to claim_search at the end of all comments
-        if len(comments) > 0:
-            pageChannels = 1
-            hasMorePagesChannels = True
-            while hasMorePagesChannels is True :
-                channelInfosURL = 'https://api.na-backend.odysee.com/api/v1/proxy?m=claim_search'
-                headers = {"Content-Type": "application/json-rpc", "Origin": "https://odysee.com", "Referer": "https://odysee.com"}
-                data = {
-                    "jsonrpc": "2.0",
-                    "method": "claim_search",
-                    "params": {
-                        "page_size": 999, # automatically set to 50 in response
-                        "page": pageChannels,
-                        "no_totals": False,
-                        "claim_ids": channel_ids
-                    }
-                }
-                print(channelInfosURL)
-                try:
-                    response = requests.post(channelInfosURL, json=data, headers=headers)
-                    if response.status_code == 200:
-                        channelInfosResponse = response.text
-                        channel_json = json.loads(channelInfosResponse)
-                    else:
-                        print(f"[×] channel_ids={channel_ids} Response of channelInfosURL {channelInfosURL} isn't OK : {response.status_code} {response.text}")
-                        self.writelog(f"[×] channel_ids={channel_ids} Response of channelInfosURL {channelInfosURL} isn't OK : {response.status_code} {response.text}")
-                        self.exitProgram()                
-                except Exception as e:
-                    print(f"[×] channel_ids={channel_ids} Error channelInfosURL {channelInfosURL} : {e}")
-                    self.writelog(f"[×] channel_ids={channel_ids} Error channelInfosURL {channelInfosURL} : {e}")
-                    self.exitProgram()
-
-                if 'error' in channel_json:
-                    print(f"[×] channel_ids={channel_ids} Error getting claim_search channelInfosURL={channelInfosURL} data={data} : {channel_json['error']['message']}")
-                    self.writelog(f"[×] channel_ids={channel_ids} Error getting claim_search channelInfosURL={channelInfosURL} data={data} : {channel_json['error']['message']}")
-                    self.exitProgram()                                        
-                
-                result = channel_json.get('result')
-                items = result.get('items')
-                for item in items:
-                    channel_infos[item['claim_id']] = item.get('value').get('title')                        
-                                                        
-                total_pagesChannels = result['total_pages']
-                pageChannels = pageChannels + 1
-
-                if pageChannels > total_pagesChannels:
-                    hasMorePagesChannels = False
+    # Find the level of each reply and attach it to its parent, comments are indexed by comment_id so every reply is handled once
+    # Replies whose parent isn't in the list (eg. on another page or deleted) have no level and aren't attached
+    def build_levels(self, root_comments, all_replies):
+        replies_by_id = {rep["comment_id"]: rep for rep in all_replies}
+        level_of = {base["comment_id"]: 1 for base in root_comments}
 
-            # Add channel_title to each comment
-            # Sometimes channel_id isn't found in claim_search call (eg. comment appears in comment.List but not on Odysee, and channel_id don't exist anymore)
-            for comment in comments:
-                comment['channel_title'] = channel_infos.get(comment['channel_id'], comment['channel_name'])
+        for rep in all_replies:
+            # Walk up the parents until one with a known level, the walk is iterative so deep threads don't hit the recursion limit
+            chain = []
+            chain_ids = set()
+            current = rep
+            while current["comment_id"] not in level_of:
+                chain.append(current)
+                chain_ids.add(current["comment_id"])
+                parent_id = current["parent_id"]
+                if parent_id in level_of:
+                    break
+                if parent_id not in replies_by_id or parent_id in chain_ids:
+                    # Unknown parent or cycle : the whole chain is unreachable from root comments
+                    level_of[parent_id] = None
+                    break
+                current = replies_by_id[parent_id]
+
+            for curr in reversed(chain):
+                parent_level = level_of[curr["parent_id"]]
+                level_of[curr["comment_id"]] = None if parent_level is None else parent_level + 1
+
+        lvl_comments = {1: self.augment_replies(root_comments)}
+        comments_by_id = {base["comment_id"]: base for base in root_comments}
+        for rep in all_replies:
+            level = level_of[rep["comment_id"]]
+            if level is not None:
+                # Each reply may have more sub-replies.
+                # We allocate the space for them.
+                rep["sub_replies"] = []
+                comments_by_id[rep["comment_id"]] = rep
+                lvl_comments.setdefault(level, []).append(rep)
+
+        # Replies are attached in their order in the raw list
+        for rep in all_replies:
+            if level_of[rep["comment_id"]] is not None:
+                comments_by_id[rep["parent_id"]]["sub_replies"].append(rep)
 
-        n_comms = len(comments)
-        n_base = len(root_comments)
-        n_replies = len(all_replies)
+        return {n: lvl_comments[n] for n in range(1, len(lvl_comments) + 1)}
 
-        n = 1
-        lvl_comments = {n: self.augment_replies(root_comments)}
+    # Search channel_title for each channel that comments
+    # Titles are kept in channelCache for the whole run, so only channels never seen before are searched
+    def add_channel_titles(self, comments):
+        unseen_ids = self.channelCache.unseen(comment['channel_id'] for comment in comments)
 
-        while True:
-            replies_sub = self.find_replies(all_replies, lvl_comments[n])
-            n_lvl = len(replies_sub)
+        # Unseen channels are searched by batches of 200 channel_ids
+        for start in range(0, len(unseen_ids), 200):
+            channel_ids = unseen_ids[start:start + 200]
+            self.channelCache.update(channel_ids, self.get_channel_titles(channel_ids))
 
-            if n_lvl:
-                n += 1
-                lvl_comments[n] = replies_sub
-            else:
-                break
+        # Add channel_title to each comment
+        # Sometimes channel_id isn't found in claim_search call (eg. comment appears in comment.List but not on Odysee, and channel_id don't exist anymore)
+        for comment in comments:
+            comment['channel_title'] = self.channelCache.get(comment['channel_id'], comment['channel_name'])
 
-        indices = list(range(2, len(lvl_comments) + 1))
-        indices.reverse()
+    # Return channel_id -> title for channel_ids found by claim_search
+    def get_channel_titles(self, channel_ids):
+        channel_infos = {}
 
-        for n in indices:
-            for rep in lvl_comments[n]:
-                for base in lvl_comments[n-1]:
-                    if rep["parent_id"] == base["comment_id"]:
-                        base["sub_replies"].append(rep)
+        pageChannels = 1
+        hasMorePagesChannels = True
+        while hasMorePagesChannels is True :
+            channelInfosURL = 'https://api.na-backend.odysee.com/api/v1/proxy?m=claim_search'
+            headers = {"Content-Type": "application/json-rpc", "Origin": "https://odysee.com", "Referer": "https://odysee.com"}
+            data = {
+                "jsonrpc": "2.0",
+                "method": "claim_search",
+                "params": {
+                    "page_size": 999, # automatically set to 50 in response
+                    "page": pageChannels,
+                    "no_totals": False,
+                    "claim_ids": channel_ids
+                }
+            }
+            print(channelInfosURL)
+            try:
+                response = self.client.post(channelInfosURL, json=data, headers=headers)
+                if response.status_code == 200:
+                    channelInfosResponse = response.text
+                    channel_json = json.loads(channelInfosResponse)
+                else:
+                    print(f"[×] channel_ids={channel_ids} Response of channelInfosURL {channelInfosURL} isn't OK : {response.status_code} {response.text}")
+                    self.writelog(f"[×] channel_ids={channel_ids} Response of channelInfosURL {channelInfosURL} isn't OK : {response.status_code} {response.text}")
+                    self.exitProgram()                
+            except Exception as e:
+                print(f"[×] channel_ids={channel_ids} Error channelInfosURL {channelInfosURL} : {e}")
+                self.writelog(f"[×] channel_ids={channel_ids} Error channelInfosURL {channelInfosURL} : {e}")
+                self.exitProgram()
 
-        return {"root_comments": root_comments,
-                "replies": all_replies,
-                "levels": lvl_comments}
+            if 'error' in channel_json:
+                print(f"[×] channel_ids={channel_ids} Error getting claim_search channelInfosURL={channelInfosURL} data={data} : {channel_json['error']['message']}")
+                self.writelog(f"[×] channel_ids={channel_ids} Error getting claim_search channelInfosURL={channelInfosURL} data={data} : {channel_json['error']['message']}")
+                self.exitProgram()                                        
+            
+            result = channel_json.get('result')
+            items = result.get('items')
+            for item in items:
+                channel_infos[item['claim_id']] = item.get('value').get('title')                        
+                                                    
+            total_pagesChannels = result['total_pages']
+            pageChannels = pageChannels + 1
+
+            if pageChannels > total_pagesChannels:
+                hasMorePagesChannels = False
+
+        return channel_infos
+
+    # Write comments and their replies depth-first
+    # An explicit stack of (remaining comments, indent) is used instead of recursion, so threads thousands of replies deep don't hit the recursion limit
+    # claim_id is the claim written in the records of outputFormats
+    def writeComments(self, comments, indent=0, claim_id=None):
+        written = 0
+        stack = [(iter(comments), indent)]
+        while stack:
+            siblings, indent = stack[-1]
+            comment = next(siblings, None)
+            if comment is None:
+                stack.pop()
+                continue
 
-    def writeComments(self, comments, indent=0):
-        for num, comment in enumerate(comments, start=1):
             ch_id = comment.get("channel_id")
             # If a title hasn't been set by channel owner, title is missing so we take channel_name
             ch_name = comment.get("channel_title") if comment.get("channel_title") is not None else comment.get("channel_name")
@@ -282,25 +569,57 @@ class Program():
             date_text = datetime.fromtimestamp(int(release_time), self.tzinfo).strftime(self.dateFormats['dateString'])
 
             line = date_text + " " + ch_name + " " + "(" + ch_id + ") : " + comm
-            indent_line = Indent()
-            indent_line.add(line, indent)
-            self.writeresult(str(indent_line))
-            self.writeresult('\n')
+            self.commentsIndent.add(line, indent)
+            written = written + 1
+
+            if self.archive is not None:
+                self.archiveComment(claim_id, comment.get("comment_id"), comment.get("parent_id"), ch_id, ch_name, release_time, comm)
+
+            if self.exporters:
+                record = {
+                    "claim_id": claim_id,
+                    "comment_id": comment.get("comment_id"),
+                    "parent_id": comment.get("parent_id"),
+                    "depth": indent // 4,
+                    "timestamp": release_time,
+                    "date": date_text,
+                    "channel_id": ch_id,
+                    "channel_name": ch_name,
+                    "comment": comm
+                }
+                for exporter in self.exporters.values():
+                    exporter.write(record)
 
             if ("replies" in comment
                     and "sub_replies" in comment
                     and comment["sub_replies"]):
-                self.writeComments(comment["sub_replies"], indent=indent+4)
+                stack.append((iter(comment["sub_replies"]), indent + 4))
 
-    def main(self):
-        print("Starting program")
-        self.writelog("Starting program")
-        self.initChannel()
+        # Counted once per call, not per comment
+        self.metrics.addItems("export", "comments", written)
 
-        self.writeresult("Channel " + self.urlchannel + " id : " + self.idchannel)
-        self.writeresult("\n\n")
-        
-        # Get all ressources of Content tab of Odysee channel
+    def flushArchive(self):
+        if self.archive is None:
+            return
+
+        try:
+            self.archive.flush()
+        except sqlite3.Error as e:
+            print(f"[×] Error writing archive {self.archive.filename} : {e}")
+            self.writelog(f"[×] Error writing archive {self.archive.filename} : {e}")
+            self.exitProgram()
+
+    def archiveComment(self, claim_id, comment_id, parent_id, channel_id, channel_title, timestamp, text):
+        try:
+            self.archive.addComment(comment_id, parent_id, claim_id, channel_id, channel_title, timestamp, text)
+        except sqlite3.Error as e:
+            print(f"[×] claim_id={claim_id} Error writing archive {self.archive.filename} : {e}")
+            self.writelog(f"[×] claim_id={claim_id} Error writing archive {self.archive.filename} : {e}")
+            self.exitProgram()
+
+    # Get one page of ressources of Content tab of Odysee channel
+    # release_time is a list of constraints (eg. [">=1600000000", "<1700000000"]) when claims are enumerated by shards
+    def getClaimsPage(self, page, release_time=None):
         claimsURL = 'https://api.na-backend.odysee.com/api/v1/proxy?m=claim_search'
         headers = {"Content-Type": "application/json-rpc", "Origin": "https://odysee.com", "Referer": "https://odysee.com"}
         dataClaimsURL = {
@@ -308,7 +627,7 @@ class Program():
             "method": "claim_search",
             "params": {
                 "page_size": 999, # automatically set to 50 in response
-                "page": 1,
+                "page": page,
                 "no_totals": False,
                 "order_by": [
                     "release_time"
@@ -318,123 +637,307 @@ class Program():
                 ]
             }
         }
+        if release_time is not None:
+            dataClaimsURL['params']['release_time'] = release_time
         print(claimsURL)
-
-        pageClaims = 1
-        hasMorePagesClaims = True
-        while hasMorePagesClaims is True:
-            dataClaimsURL['params']['page'] = pageClaims
-            try:
-                response = requests.post(claimsURL, json=dataClaimsURL, headers=headers)
-                if response.status_code == 200:
-                    claimsResponse = response.text
-                    claims_json = json.loads(claimsResponse)
-                    if 'error' in claims_json:
-                        print(f"[×] Error getting claims claimsURL={claimsURL} data={dataClaimsURL} : {claims_json['error']['message']}")
-                        self.writelog(f"[×] Error getting claims claimsURL={claimsURL} data={dataClaimsURL} : {claims_json['error']['message']}")
-                        self.exitProgram()
-                else:
-                    print(f"[×] Response of claimsURL {claimsURL} isn't OK : {response.status_code} {response.text}")
-                    self.writelog(f"[×] Response of claimsURL {claimsURL} isn't OK : {response.status_code} {response.text}")
+        try:
+            response = self.client.post(claimsURL, json=dataClaimsURL, headers=headers)
+            if response.status_code == 200:
+                claimsResponse = response.text
+                claims_json = json.loads(claimsResponse)
+                if 'error' in claims_json:
+                    print(f"[×] Error getting claims claimsURL={claimsURL} data={dataClaimsURL} : {claims_json['error']['message']}")
+                    self.writelog(f"[×] Error getting claims claimsURL={claimsURL} data={dataClaimsURL} : {claims_json['error']['message']}")
                     self.exitProgram()
-            except Exception as e:
-                print(f"[×] Error claimsURL {claimsURL} : {e}")
-                self.writelog(f"[×] Error claimsURL {claimsURL} : {e}")
+            else:
+                print(f"[×] Response of claimsURL {claimsURL} isn't OK : {response.status_code} {response.text}")
+                self.writelog(f"[×] Response of claimsURL {claimsURL} isn't OK : {response.status_code} {response.text}")
                 self.exitProgram()
-            
-            result = claims_json.get('result')
-            items = result.get('items')
-            total_pagesClaims = result.get('total_pages')
+        except Exception as e:
+            print(f"[×] Error claimsURL {claimsURL} : {e}")
+            self.writelog(f"[×] Error claimsURL {claimsURL} : {e}")
+            self.exitProgram()
 
-            for item in items:
-                url = item.get('canonical_url').replace('lbry://@', 'https://odysee.com/@').replace('#', ':')
-                claim_id = item.get('claim_id')
-                
-                print(url)
-                self.writeresult(url)
-                self.writeresult("\n")
+        return claims_json.get('result')
+
+    # claim_search pages of the channel from startPage, fetched ahead of the claims being handled
+    # With shardClaims, pages come from release_time ranges fetched in parallel, for channels with tens of thousands of claims
+    def getClaimsPages(self, startPage=1):
+        if self.shardClaims is True:
+            return ShardedClaimLister(self.getClaimsPage, self.shardWorkers, onError=self.exitProgram, startPage=startPage)
+
+        return PagePrefetcher(self.getClaimsPage, self.prefetchPages, onError=self.exitProgram, startPage=startPage)
+
+    # (claim page, claim_search page) from the claim page of the checkpoint
+    # When the claim of the checkpoint isn't on this page anymore (eg. claims were published or deleted since), the channel is listed again from its first page
+    def getResumedClaimsPages(self):
+        startPage = self.checkpoint['claimPage']
+        pages = iter(self.getClaimsPages(startPage))
+        result = next(pages, None)
+        if result is not None and any(item.get('claim_id') == self.checkpoint['claim_id'] for item in result.get('items')):
+            yield startPage, result
+            yield from enumerate(pages, startPage + 1)
+            return
+
+        pages.close()
+        print(f"claim_id={self.checkpoint['claim_id']} of checkpoint isn't on claim page {startPage} anymore, listing all claims")
+        self.writelog(f"claim_id={self.checkpoint['claim_id']} of checkpoint isn't on claim page {startPage} anymore, listing all claims")
+        yield from enumerate(self.getClaimsPages(), 1)
+
+    def writeClaim(self, item):
+        url = item.get('canonical_url').replace('lbry://@', 'https://odysee.com/@').replace('#', ':')
+        claim_id = item.get('claim_id')
+        self.metrics.addItems("export", "claims")
+        
+        print(url)
+        self.writeresult(url)
+        self.writeresult("\n")
+
+        if "release_time" not in item:
+            release_time = item.get("timestamp")
+        else:
+            release_time = item.get("release_time")
+
+        dateVideo_text = datetime.fromtimestamp(int(release_time), self.tzinfo).strftime(self.dateFormats['dateString'])
+
+        claim_type = item.get('value_type')
+        reposted_claim = item.get('reposted_claim')
+        if claim_type == 'repost':
+            value = reposted_claim.get('value')
+            title = value.get('title')
+            duration = value.get('video').get('duration')
+        else:
+            value = item.get('value')
+            title = value.get('title')
+            duration = value.get('video').get('duration')
+        
+        hours = duration // 3600
+        minutes = (duration % 3600) // 60
+        seconds = (duration % 3600) % 60
+        if hours > 0:
+            durationString = '{:02d}H{:02d}M{:02d}S'.format(hours, minutes, seconds)
+        elif minutes > 0:
+            durationString = '{:02d}M{:02d}S'.format(minutes, seconds)
+        else:
+            durationString = '{:02d}S'.format(seconds)
+
+        print("Date : " + dateVideo_text)
+        self.writeresult("Date : " + dateVideo_text)
+        self.writeresult("\n")
+        print("Id : " + str(claim_id))
+        self.writeresult("Id : " + str(claim_id))
+        self.writeresult("\n")
+        print("Title : " + str(title))
+        self.writeresult("Title : " + str(title))
+        self.writeresult("\n")
+        print("Duration : " + str(durationString))
+        self.writeresult("Duration : " + str(durationString))
+        self.writeresult("\n")
+
+        if claim_type == 'repost':
+            self.writeresult("\nOriginal content :\n")
+            self.writeresult("URL : " + reposted_claim.get('canonical_url').replace('lbry://@', 'https://odysee.com/@').replace('#', ':'))
+            self.writeresult("\n")
+            self.writeresult("Id : " + reposted_claim.get('claim_id'))
+            self.writeresult("\n")
+            self.writeresult("Date original content : " + datetime.fromtimestamp(int(reposted_claim.get('timestamp')), self.tzinfo).strftime(self.dateFormats['dateString']))
+            self.writeresult("\n")
+            self.writeresult("Author : " + reposted_claim.get('signing_channel').get('canonical_url').replace('lbry://@', 'https://odysee.com/@').replace('#', ':') +
+            " (" + reposted_claim.get('signing_channel').get('claim_id') + ")")
+            self.writeresult("\n")
+
+        if self.archive is not None:
+            self.archive.addClaim(claim_id, self.idchannel, url, title, int(release_time))
+
+    # Comments of a repost are the comments of the original content
+    def getCommentsClaimId(self, item):
+        if item.get('value_type') == 'repost':
+            return item.get('reposted_claim').get('claim_id')
+
+        return item.get('claim_id')
+
+    # Write the comments of a claim newer than the last export, return False when the claim has no new comment
+    # A probe of probeSize newest comments gives total_items and the newest comment, like getCommentsCount in videos.py
+    # Changed claims are then paged newest first until the newest comment of the last export
+    def writeNewComments(self, item, claimPage):
+        claim_id_additionnalreq = self.getCommentsClaimId(item)
+
+        commentsRequest = self.getComments(claim_id_additionnalreq, 1, self.probeSize)
+        if commentsRequest is None:
+            self.exitProgram()
+        if self.syncState.unchanged(claim_id_additionnalreq, commentsRequest):
+            return False
 
-                if "release_time" not in item:
-                    release_time = item.get("timestamp")
-                else:
-                    release_time = item.get("release_time")
+        firstPage = commentsRequest
+        probing = True
+        newComments = []
+        pageComments = 1
+        while True:
+            reachedOld = False
+            for comment in commentsRequest.get('items', []):
+                if not self.syncState.isNew(claim_id_additionnalreq, comment):
+                    reachedOld = True
+                    break
+                newComments.append(comment)
+
+            if reachedOld is True or pageComments >= commentsRequest['total_pages']:
+                break
+            if probing is True:
+                # The probe is too small, start again with full pages
+                probing = False
+                newComments = []
+                commentsRequest = self.getComments(claim_id_additionnalreq, 1)
+                firstPage = commentsRequest
+            else:
+                pageComments = pageComments + 1
+                commentsRequest = self.getComments(claim_id_additionnalreq, pageComments)
+            if commentsRequest is None:
+                self.exitProgram()
 
-                dateVideo_text = datetime.fromtimestamp(int(release_time), self.tzinfo).strftime(self.dateFormats['dateString'])
+        # Only deletions since the last export
+        if not newComments:
+            self.syncState.update(claim_id_additionnalreq, firstPage)
+            return False
 
-                claim_type = item.get('value_type')
-                reposted_claim = item.get('reposted_claim')
-                if claim_type == 'repost':
-                    value = reposted_claim.get('value')
-                    claim_id_additionnalreq = reposted_claim.get('claim_id')
-                    title = value.get('title')
-                    duration = value.get('video').get('duration')
-                else:
-                    value = item.get('value')
-                    claim_id_additionnalreq = claim_id
-                    title = value.get('title')
-                    duration = value.get('video').get('duration')
-                
-                hours = duration // 3600
-                minutes = (duration % 3600) // 60
-                seconds = (duration % 3600) % 60
-                if hours > 0:
-                    durationString = '{:02d}H{:02d}M{:02d}S'.format(hours, minutes, seconds)
-                elif minutes > 0:
-                    durationString = '{:02d}M{:02d}S'.format(minutes, seconds)
-                else:
-                    durationString = '{:02d}S'.format(seconds)
+        self.writeClaim(item)
+        self.writeresult("\nNew comments : " + str(len(newComments)) + "\n")
 
-                print("Date : " + dateVideo_text)
-                self.writeresult("Date : " + dateVideo_text)
-                self.writeresult("\n")
-                print("Id : " + str(claim_id))
-                self.writeresult("Id : " + str(claim_id))
-                self.writeresult("\n")
-                print("Title : " + str(title))
-                self.writeresult("Title : " + str(title))
-                self.writeresult("\n")
-                print("Duration : " + str(durationString))
-                self.writeresult("Duration : " + str(durationString))
+        # Replies to comments of previous exports are written as threads of their own
+        self.add_channel_titles(newComments)
+        newIds = {comment["comment_id"] for comment in newComments}
+        root_comments = []
+        all_replies = []
+        for comment in newComments:
+            if "parent_id" in comment and comment["parent_id"] in newIds:
+                all_replies.append(comment)
+            else:
+                root_comments.append(comment)
+        with self.profiler.phase("tree"):
+            self.build_levels(root_comments, all_replies)
+
+        with self.profiler.phase("render"):
+            for root in root_comments:
+                if "parent_id" in root:
+                    self.writeresult("In reply to comment " + root["parent_id"] + " :\n")
+                self.writeComments([root], claim_id=item.get('claim_id'))
+
+        self.writeresult("\n")
+        self.syncState.update(claim_id_additionnalreq, firstPage)
+        self.writeCheckpoint(claimPage, item, None, None)
+
+        return True
+
+    # Write all comments of a claim from startPage, threadAssembler holds threads left open by previous pages
+    def writeClaimComments(self, item, claimPage, startPage=1, threadAssembler=None):
+        claim_id_additionnalreq = self.getCommentsClaimId(item)
+
+        # Get all comments, copied from https://github.com/belikor/lbrytools/comment_list.py functions with small edits
+        if threadAssembler is None:
+            threadAssembler = ThreadAssembler()
+
+        for pageComments, commentsRequest in self.profiler.iterate("fetch", self.iterCommentsPages(claim_id_additionnalreq, startPage)):
+            # Pages are sorted newest first, page 1 gives the state of the claim for the next incremental export
+            if pageComments == 1 and self.syncState is not None:
+                self.syncState.update(claim_id_additionnalreq, commentsRequest)
+
+            # Sometimes 'items' key isn't present
+            comments = commentsRequest.get('items', [])
+            with self.profiler.phase("fetch"):
+                self.add_channel_titles(comments)
+
+            # Threads are written as soon as they are complete, replies can come on a page before or after their parent
+            with self.profiler.phase("tree"):
+                threads = threadAssembler.add_page(comments)
+            with self.profiler.phase("render"):
+                self.writeComments(threads, claim_id=item.get('claim_id'))
+            self.writeCheckpoint(claimPage, item, pageComments, threadAssembler)
+
+        with self.profiler.phase("tree"):
+            threads = threadAssembler.finish()
+        with self.profiler.phase("render"):
+            self.writeComments(threads, claim_id=item.get('claim_id'))
+
+        self.writeresult("\n")
+        self.writeCheckpoint(claimPage, item, None, None)
+
+    def main(self):
+        self.mainThread = threading.current_thread()
+        print("Starting program")
+        self.writelog("Starting program")
+        if self.profile is True:
+            self.profiler.start()
+        self.metrics.startPhase("init")
+        self.initChannel()
+        self.metrics.endPhase("init")
+
+        # Claims are skipped until the claim of the checkpoint when an interrupted export is resumed
+        resuming = self.checkpoint is not None
+        if resuming is True:
+            print(f"Resuming {self.resultfilename} at claim_id={self.checkpoint['claim_id']} (claim page {self.checkpoint['claimPage']}, comment page {self.checkpoint['commentPage']})")
+            self.writelog(f"Resuming {self.resultfilename} at claim_id={self.checkpoint['claim_id']} (claim page {self.checkpoint['claimPage']}, comment page {self.checkpoint['commentPage']})")
+        else:
+            self.writeresult("Channel " + self.urlchannel + " id : " + self.idchannel)
+            self.writeresult("\n")
+            if self.syncState is not None and self.syncState.lastExport is not None:
+                lastExport_text = datetime.fromtimestamp(self.syncState.lastExport, self.tzinfo).strftime(self.dateFormats['dateString'])
+                self.writeresult("Only claims with comments since last export of " + lastExport_text)
                 self.writeresult("\n")
+            self.writeresult("\n")
+        
+        # Get all ressources of Content tab of Odysee channel, next pages are fetched in background while claims are handled
+        # A resumed export starts at the claim page of the checkpoint
+        self.metrics.startPhase("export")
+        claimsPages = self.getResumedClaimsPages() if resuming is True else enumerate(self.getClaimsPages(), 1)
+        unchangedClaims = 0
+        for claimPage, result in self.profiler.iterate("listing", claimsPages):
+            items = result.get('items')
+
+            for item in items:
+                if resuming is True:
+                    if item.get('claim_id') == self.checkpoint['claim_id']:
+                        resuming = False
+                        # Comments of the claim of the checkpoint were all written or are continued from the next comment page
+                        if self.checkpoint['commentPage'] is not None:
+                            threadAssembler = ThreadAssembler.from_state(self.checkpoint['threads'])
+                            self.writeClaimComments(item, claimPage, self.checkpoint['commentPage'] + 1, threadAssembler)
+                        continue
+                    # Claims are listed newest first : when the claim of the checkpoint was deleted since, the export goes on from the first claim older than it
+                    if self.checkpoint.get('release_time') is None or getReleaseTime(item) >= self.checkpoint['release_time']:
+                        continue
+                    resuming = False
+                    print(f"claim_id={self.checkpoint['claim_id']} of checkpoint not found, resuming at claim_id={item.get('claim_id')}")
+                    self.writelog(f"claim_id={self.checkpoint['claim_id']} of checkpoint not found, resuming at claim_id={item.get('claim_id')}")
+
+                # Claims of the last export only get their new comments, other claims get all of them
+                if self.syncState is not None and self.syncState.get(self.getCommentsClaimId(item)) is not None:
+                    # Probes and pages of new comments, their tree and rendering are phases of their own
+                    with self.profiler.phase("fetch"):
+                        changedClaim = self.writeNewComments(item, claimPage)
+                    if changedClaim is False:
+                        unchangedClaims = unchangedClaims + 1
+                    continue
+
+                self.writeClaim(item)
+                self.writeClaimComments(item, claimPage)
+
+        # Without its release_time (checkpoint of an older version), what remained to export is unknown : the checkpoint is kept
+        # With it, no claim is older than the claim of the checkpoint and the export is complete
+        if resuming is True and self.checkpoint.get('release_time') is None:
+            print(f"[×] claim_id={self.checkpoint['claim_id']} of checkpoint not found, nothing was resumed")
+            self.writelog(f"[×] claim_id={self.checkpoint['claim_id']} of checkpoint not found, nothing was resumed")
+            self.exitProgram()
+
+        if self.syncState is not None:
+            print(f"{unchangedClaims} claims without new comments since last export")
+            self.writelog(f"{unchangedClaims} claims without new comments since last export")
+            # Saved only once the export is complete, an interrupted export leaves the state of the last complete one
+            self.syncState.save()
 
-                if claim_type == 'repost':
-                    self.writeresult("\nOriginal content :\n")
-                    self.writeresult("URL : " + reposted_claim.get('canonical_url').replace('lbry://@', 'https://odysee.com/@').replace('#', ':'))
-                    self.writeresult("\n")
-                    self.writeresult("Id : " + reposted_claim.get('claim_id'))
-                    self.writeresult("\n")
-                    self.writeresult("Date original content : " + datetime.fromtimestamp(int(reposted_claim.get('timestamp')), self.tzinfo).strftime(self.dateFormats['dateString']))
-                    self.writeresult("\n")
-                    self.writeresult("Author : " + reposted_claim.get('signing_channel').get('canonical_url').replace('lbry://@', 'https://odysee.com/@').replace('#', ':') +
-                    " (" + reposted_claim.get('signing_channel').get('claim_id') + ")")
-                    self.writeresult("\n")
-
-                # Get all comments, copied from https://github.com/belikor/lbrytools/comment_list.py functions with small edits
-                pageComments = 1
-                total_pagesComments = 1
-                hasMorePagesComments = True
-
-                while hasMorePagesComments is True:
-                    commentsRequest = self.getComments(claim_id_additionnalreq, pageComments)
-                    if commentsRequest is None:
-                        self.exitProgram()
-
-                    # Sometimes 'items' key isn't present
-                    comments = commentsRequest.get('items', [])
-
-                    comments = self.arrange_comments(comments)
-                    self.writeComments(comments['root_comments'])
-                    total_pagesComments = commentsRequest['total_pages']                       
-
-                    pageComments = pageComments + 1
-                    if pageComments > total_pagesComments:
-                        hasMorePagesComments = False
-
-                self.writeresult("\n")                
-                
-            pageClaims = pageClaims + 1
-            if pageClaims > total_pagesClaims:
-                hasMorePagesClaims = False
+        self.flushArchive()
+        self.metrics.endPhase("export")
+
+        # Export is complete, next run starts a new result file
+        self.removeCheckpoint()
 
         print("Execution was OK")
         self.writelog("Execution was OK")
@@ -447,11 +950,43 @@ if __name__ == "__main__":
     handlechannel = '' # What's come after https://odysee.com/@
     idchannel = '' # idchannel is "Claim ID" value on About page of channel
 
+    # Channel titles of commenters
+    channelCacheFile = None # eg. "channels_cache.json" to reuse channel titles in next runs
+    channelCacheTTL = 7 * 24 * 3600 # Channel titles older than this number of seconds are searched again
+
+    # Engine
+    commentsWorkers = 4 # Number of comment.List pages of a video fetched in parallel
+    prefetchPages = 2 # Number of claim_search pages fetched ahead of the claims being handled
+    shardClaims = False # True to list claims by release_time ranges fetched in parallel (channels with tens of thousands of claims)
+    shardWorkers = 4 # Number of release_time ranges fetched in parallel when shardClaims is True
+
+    # Checkpoint
+    checkpointing = True # Record in comments_<idchannel>.checkpoint what was fully written
+    checkpointInterval = 30 # Minimum number of seconds between two checkpoints, an interrupted export starts again from the last one
+    resume = False # True to continue an interrupted export from its checkpoint, in the same result file
+
+    # Incremental export
+    incremental = False # True to write only comments newer than the last export, state is kept in comments_<idchannel>.state
+    probeSize = 20 # Number of newest comments fetched to know if a claim changed
+
+    # Structured outputs
+    outputFormats = [] # eg. ["ndjson", "csv"] to also write one record per comment next to the result file
+    archiveFile = None # eg. "comments_archive.sqlite" to also archive claims and comments with a full-text index on comments
+
+    # Cassette
+    cassetteFile = None # eg. "comments.cassette.gz" to record requests and responses of the run, or to replay them without network
+    cassetteMode = "record" # "record" or "replay"
+    latencyScale = 1.0 # Replayed responses wait their recorded latency multiplied by latencyScale, 0 to not wait
+
+    # Metrics
+    writeMetrics = False # True to write requests by endpoint (statuses, bytes, retries, latency) and throughput of each phase in comments_<idchannel>_<date>.metrics.json and .prom
+    profile = False # True to profile CPU (cProfile) and allocations (tracemalloc) of listing, fetch, tree, render and write phases in comments_<idchannel>_<date>.profile.txt, slows the export down
+
     # Format
     tz = "Europe/Paris"
     dateFormats = {"dateString": "%d/%m/%Y %H:%M:%S", "dateDBString": "%Y-%m-%d %H:%M:%S", "dateFileString": "%d%m%Y%H%M%S"}
     
     # Launch
-    program = Program(idchannel, handlechannel, tz, dateFormats)
+    program = Program(idchannel, handlechannel, tz, dateFormats, channelCache=ChannelCache(channelCacheFile, channelCacheTTL), commentsWorkers=commentsWorkers, prefetchPages=prefetchPages, shardClaims=shardClaims, shardWorkers=shardWorkers, checkpointing=checkpointing, checkpointInterval=checkpointInterval, resume=resume, incremental=incremental, probeSize=probeSize, outputFormats=outputFormats, archiveFile=archiveFile, cassette=openCassette(cassetteFile, cassetteMode, latencyScale) if cassetteFile is not None else None, writeMetrics=writeMetrics, profile=profile)
     program.main()
 
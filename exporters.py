@@ -0,0 +1,75 @@
+# -*- encoding: utf-8 -*-
+
+import csv, json, os
+
+# Structured outputs written alongside the text result file, one record per claim or per comment
+# Records are written as they come through a large buffer, a channel is never held in memory
+BUFFER_SIZE = 1024 * 1024
+
+# One JSON object per line
+class NdjsonExporter():
+    extension = ".ndjson"
+
+    # With offset, the file of an interrupted export is cut at offset and continued
+    def __init__(self, filename, fields, offset=None):
+        self.filename = filename
+        self.fields = fields
+        self.file = openOutput(filename, offset)
+
+    def write(self, record):
+        self.file.write(json.dumps({field: record.get(field) for field in self.fields}, ensure_ascii=False))
+        self.file.write("\n")
+
+    # Size of what was written, once synced to disk
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+# Header line with fields, then one line per record
+class CsvExporter():
+    extension = ".csv"
+
+    def __init__(self, filename, fields, offset=None):
+        self.filename = filename
+        self.fields = fields
+        self.file = openOutput(filename, offset)
+        self.writer = csv.DictWriter(self.file, fieldnames=fields, extrasaction="ignore")
+        if offset is None:
+            self.writer.writeheader()
+
+    def write(self, record):
+        self.writer.writerow(record)
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+EXPORTERS = {"ndjson": NdjsonExporter, "csv": CsvExporter}
+
+def openOutput(filename, offset):
+    if offset is not None:
+        os.truncate(filename, offset)
+        return open(filename, "a", encoding="utf-8", newline="", buffering=BUFFER_SIZE)
+
+    return open(filename, "w", encoding="utf-8", newline="", buffering=BUFFER_SIZE)
+
+# Exporters of outputFormats (eg. ["ndjson", "csv"]) for files named basename + extension
+# offsets : format -> offset, to continue the files of an interrupted export
+def openExporters(basename, outputFormats, fields, offsets=None):
+    exporters = {}
+    for outputFormat in outputFormats:
+        if outputFormat not in EXPORTERS:
+            raise ValueError(f"Unknown output format {outputFormat}, expected one of {', '.join(EXPORTERS)}")
+        exporter = EXPORTERS[outputFormat]
+        offset = offsets.get(outputFormat) if offsets is not None else None
+        exporters[outputFormat] = exporter(basename + exporter.extension, fields, offset)
+
+    return exporters
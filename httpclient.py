@@ -0,0 +1,271 @@
+# -*- encoding: utf-8 -*-
+
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit, parse_qs
+import copy, random, threading, time
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import Metrics
+
+# Name of the API endpoint of an url, eg. "api.na-backend.odysee.com/api/v1/proxy?m=claim_search" or "api.odysee.com/file/view_count"
+def getEndpoint(url):
+    parts = urlsplit(url)
+    endpoint = parts.netloc + parts.path
+    method = parse_qs(parts.query).get('m')
+    if method is not None:
+        endpoint = endpoint + "?m=" + method[0]
+
+    return endpoint
+
+# Retry of transient failures (connection errors, timeouts, connections dropped in the middle of a body, 429 and 5xx responses) with jittered exponential backoff
+# The delay asked by a Retry-After header is used when there is one
+# Each endpoint has a budget of retries for the whole run, so an endpoint that is really down doesn't retry forever
+# Programs sharing a client (eg. channels of batch.py) each have their own budgets, see HttpClient.share
+class RetryPolicy():
+    def __init__(self, maxRetries=5, backoffBase=0.5, backoffMax=30, retryAfterMax=120,
+                 retryStatuses=(429, 500, 502, 503, 504), retryBudget=200, retryBudgets={}):
+        self.maxRetries = maxRetries
+        self.backoffBase = backoffBase
+        self.backoffMax = backoffMax
+        self.retryAfterMax = retryAfterMax
+        self.retryStatuses = retryStatuses
+        self.retryBudget = retryBudget
+        self.retryBudgets = retryBudgets  # endpoint -> budget, for endpoints with a budget other than retryBudget
+
+        self.lock = threading.Lock()
+        self.retriesDone = {}  # endpoint -> number of retries done
+
+    # Same policy with its budgets untouched
+    def copy(self):
+        return RetryPolicy(self.maxRetries, self.backoffBase, self.backoffMax, self.retryAfterMax, self.retryStatuses, self.retryBudget, self.retryBudgets)
+
+    # Return True and count the retry when the endpoint has retries left
+    def consume(self, endpoint):
+        with self.lock:
+            retriesDone = self.retriesDone.get(endpoint, 0)
+            if retriesDone >= self.retryBudgets.get(endpoint, self.retryBudget):
+                return False
+            self.retriesDone[endpoint] = retriesDone + 1
+            return True
+
+    def getRetryAfter(self, response):
+        retryAfter = response.headers.get('Retry-After') if response is not None else None
+        if retryAfter is None:
+            return None
+
+        # Retry-After is either a number of seconds or a HTTP date
+        try:
+            delay = float(retryAfter)
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(retryAfter) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                return None
+
+        return min(max(delay, 0), self.retryAfterMax)
+
+    # Delay before retry number attempt (starting at 1)
+    def getDelay(self, attempt, response):
+        retryAfter = self.getRetryAfter(response)
+        if retryAfter is not None:
+            return retryAfter
+
+        # Full jitter : threads failing at the same time don't retry at the same time
+        return random.uniform(0, min(self.backoffMax, self.backoffBase * 2 ** attempt))
+
+# In-flight limit of one host, adapted with AIMD (additive increase, multiplicative decrease)
+# The limit grows by about one request per round trip while responses are fast and OK,
+# and is multiplied by decreaseFactor on 429/5xx, connection errors or a latency spike
+class HostLimiter():
+    def __init__(self, initialLimit=4, minLimit=1, maxLimit=32, decreaseFactor=0.5, latencySpike=3.0):
+        self.limit = float(initialLimit)
+        self.minLimit = minLimit
+        self.maxLimit = maxLimit
+        self.decreaseFactor = decreaseFactor
+        self.latencySpike = latencySpike
+
+        self.condition = threading.Condition()
+        self.inFlight = 0
+        self.latency = None       # exponentially weighted moving average of latencies, in seconds
+        self.samples = 0
+        self.lastDecrease = 0.0
+
+    def acquire(self):
+        with self.condition:
+            while self.inFlight >= int(self.limit):
+                self.condition.wait()
+            self.inFlight = self.inFlight + 1
+
+    # latency in seconds, healthy is False for 429/5xx responses and connection errors
+    def release(self, latency, healthy):
+        with self.condition:
+            self.inFlight = self.inFlight - 1
+
+            spike = self.samples >= 10 and latency > self.latencySpike * self.latency
+            if healthy is False or spike:
+                # Requests in flight when the limit was decreased fail together, decrease only once per round trip
+                now = time.monotonic()
+                if now - self.lastDecrease > (self.latency or 0):
+                    self.limit = max(self.minLimit, self.limit * self.decreaseFactor)
+                    self.lastDecrease = now
+            else:
+                self.limit = min(self.maxLimit, self.limit + 1 / self.limit)
+
+            # Spikes aren't counted in the average, they would hide the next ones
+            if not spike:
+                self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+                self.samples = self.samples + 1
+
+            self.condition.notify_all()
+
+# One HostLimiter per host : api.na-backend.odysee.com, api.odysee.com and comments.odysee.tv have very different capacities
+class HostScheduler():
+    def __init__(self, initialLimit=4, minLimit=1, maxLimit=32):
+        self.initialLimit = initialLimit
+        self.minLimit = minLimit
+        self.maxLimit = maxLimit
+        self.lock = threading.Lock()
+        self.limiters = {}
+
+    def getLimiter(self, host):
+        with self.lock:
+            if host not in self.limiters:
+                self.limiters[host] = HostLimiter(min(self.initialLimit, self.maxLimit), self.minLimit, self.maxLimit)
+            return self.limiters[host]
+
+    # host -> current in-flight limit
+    def getLimits(self):
+        with self.lock:
+            return {host: int(limiter.limit) for host, limiter in self.limiters.items()}
+
+# Shared HTTP client of videos.py and comment.py
+# Connections to api.na-backend.odysee.com, api.odysee.com and comments.odysee.tv are kept alive and reused between requests
+# maxRequests is a global budget of requests in flight, shared by every program using the client
+# Below it, scheduler adapts the number of requests in flight to each host, up to poolSize
+class HttpClient():
+    # With baseUrl (eg. "http://127.0.0.1:8080" of mockserver.py), https://<host>/<path> is sent to <baseUrl>/<host>/<path> instead
+    # With cassette (see cassette.py), requests and responses are recorded, or responses are replayed without network
+    # Every request is counted in metrics (see metrics.py)
+    def __init__(self, poolSize=10, maxRequests=None, retryPolicy=None, timeout=60, scheduler=None, baseUrl=None, cassette=None, metrics=None):
+        self.poolSize = poolSize
+        self.metrics = Metrics() if metrics is None else metrics
+        self.baseUrl = baseUrl
+        self.cassette = cassette
+        self.budget = threading.BoundedSemaphore(maxRequests) if maxRequests is not None else None
+        self.scheduler = HostScheduler(maxLimit=poolSize) if scheduler is None else scheduler
+        self.retryPolicy = RetryPolicy() if retryPolicy is None else retryPolicy
+        self.timeout = timeout
+        self.stopped = threading.Event()
+
+        self.session = requests.Session()
+        # Odysee APIs don't need cookies, refusing them means the session is never modified by a response and can be shared between threads
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+        # One pool of poolSize keep-alive connections per host, a thread waits for a free connection rather than opening a throwaway one
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=poolSize, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def send(self, method, url, **kwargs):
+        limiter = self.scheduler.getLimiter(urlsplit(url).netloc)
+        limiter.acquire()
+        healthy = False
+        response = None
+        start = time.monotonic()
+        try:
+            if self.budget is None:
+                response = self.sendRequest(method, url, kwargs)
+            else:
+                with self.budget:
+                    response = self.sendRequest(method, url, kwargs)
+            healthy = response.status_code not in self.retryPolicy.retryStatuses
+            return response
+        finally:
+            elapsed = time.monotonic() - start
+            limiter.release(elapsed, healthy)
+            if response is None:
+                self.metrics.observeError(getEndpoint(url), elapsed)
+            else:
+                # Streamed bodies aren't read here, their size is the announced one
+                size = int(response.headers.get('Content-Length') or 0) if kwargs.get('stream') else len(response.content)
+                self.metrics.observe(getEndpoint(url), response.status_code, elapsed, size)
+
+    # Client for one more program (eg. a channel of batch.py), sharing connections, budget, scheduler, cassette and metrics of this one
+    # Its retry budgets are its own, a channel whose endpoints keep failing doesn't use up the retries of the other channels
+    # Only the client created by HttpClient() is closed
+    def share(self):
+        client = copy.copy(self)
+        client.retryPolicy = self.retryPolicy.copy()
+        client.stopped = threading.Event()
+
+        return client
+
+    # Cassettes see the Odysee url, only the request sent on network goes to baseUrl
+    def sendRequest(self, method, url, kwargs):
+        if self.cassette is not None and self.cassette.replaying is True:
+            return self.cassette.play(method, url, kwargs)
+
+        sentUrl = url
+        if self.baseUrl is not None:
+            parts = urlsplit(url)
+            sentUrl = self.baseUrl + "/" + parts.netloc + parts.path + ("?" + parts.query if parts.query else "")
+        if self.cassette is None:
+            return self.session.request(method, sentUrl, **kwargs)
+
+        start = time.monotonic()
+        response = self.session.request(method, sentUrl, **kwargs)
+        self.cassette.record(method, url, kwargs, response, time.monotonic() - start)
+
+        return response
+
+    # Send a request, retrying transient failures as allowed by retryPolicy
+    # The last response (or exception) is returned (or raised) when retries are exhausted
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        endpoint = getEndpoint(url)
+
+        attempt = 0
+        while True:
+            if self.stopped.is_set():
+                raise requests.ConnectionError(f"Client stopped, {method} {url} not sent")
+            response = None
+            try:
+                response = self.send(method, url, **kwargs)
+                if response.status_code not in self.retryPolicy.retryStatuses:
+                    return response
+                reason = str(response.status_code)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                error = e
+                reason = repr(e)
+
+            attempt = attempt + 1
+            if attempt > self.retryPolicy.maxRetries or not self.retryPolicy.consume(endpoint):
+                if response is None:
+                    raise error
+                return response
+            self.metrics.observeRetry(endpoint)
+
+            # Sleep outside of the global budget, other requests can go on meanwhile
+            delay = self.retryPolicy.getDelay(attempt, response)
+            print(f"[~] {endpoint} failed ({reason}), retry {attempt} in {delay:.2f}s")
+            if response is not None:
+                response.close()
+            self.stopped.wait(delay)
+
+    # Requests sent after stop fail at once, retries waiting are given up (eg. the program using the client failed)
+    # Clients given by share are stopped alone
+    def stop(self):
+        self.stopped.set()
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def close(self):
+        self.session.close()
+        if self.cassette is not None:
+            self.cassette.close()
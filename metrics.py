@@ -0,0 +1,150 @@
+# -*- encoding: utf-8 -*-
+
+import bisect, json, os, threading, time
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket has no bound
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Counters of the requests of a run, by endpoint : statuses, bytes, retries, errors and latency histogram
+# And duration and items handled (eg. claims, comments) of each phase of a program
+# Each observation is a few additions under a lock, written as JSON and Prometheus textfile once the run ends
+class Metrics():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}      # endpoint -> counters
+        self.phases = {}         # phase -> {"start", "seconds", "items"}
+
+    def getEndpoint(self, endpoint):
+        counters = self.endpoints.get(endpoint)
+        if counters is None:
+            counters = self.endpoints[endpoint] = {"requests": 0, "statuses": {}, "bytes": 0, "retries": 0, "errors": 0,
+                                                   "latencySum": 0.0, "latencyMax": 0.0, "buckets": [0] * (len(LATENCY_BUCKETS) + 1)}
+        return counters
+
+    # A response received after seconds
+    def observe(self, endpoint, status, seconds, size):
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self.lock:
+            counters = self.getEndpoint(endpoint)
+            counters["requests"] += 1
+            counters["statuses"][status] = counters["statuses"].get(status, 0) + 1
+            counters["bytes"] += size
+            counters["latencySum"] += seconds
+            counters["latencyMax"] = max(counters["latencyMax"], seconds)
+            counters["buckets"][bucket] += 1
+
+    # A request that raised (eg. connection error, timeout)
+    def observeError(self, endpoint, seconds):
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self.lock:
+            counters = self.getEndpoint(endpoint)
+            counters["requests"] += 1
+            counters["errors"] += 1
+            counters["latencySum"] += seconds
+            counters["latencyMax"] = max(counters["latencyMax"], seconds)
+            counters["buckets"][bucket] += 1
+
+    def observeRetry(self, endpoint):
+        with self.lock:
+            self.getEndpoint(endpoint)["retries"] += 1
+
+    def startPhase(self, phase):
+        with self.lock:
+            self.phases.setdefault(phase, {"start": None, "seconds": 0.0, "items": {}})["start"] = time.monotonic()
+
+    def endPhase(self, phase):
+        with self.lock:
+            state = self.phases[phase]
+            if state["start"] is not None:
+                state["seconds"] += time.monotonic() - state["start"]
+                state["start"] = None
+
+    # count items (eg. "claims") handled in phase
+    def addItems(self, phase, item, count=1):
+        with self.lock:
+            items = self.phases.setdefault(phase, {"start": None, "seconds": 0.0, "items": {}})["items"]
+            items[item] = items.get(item, 0) + count
+
+    def getSummary(self):
+        with self.lock:
+            endpoints = {}
+            for endpoint, counters in self.endpoints.items():
+                cumulative = 0
+                buckets = {}
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), counters["buckets"]):
+                    cumulative += count
+                    buckets[str(bound)] = cumulative
+                endpoints[endpoint] = {
+                    "requests": counters["requests"],
+                    "statuses": {str(status): count for status, count in counters["statuses"].items()},
+                    "bytes": counters["bytes"],
+                    "retries": counters["retries"],
+                    "errors": counters["errors"],
+                    "latency": {
+                        "sum": round(counters["latencySum"], 6),
+                        "mean": round(counters["latencySum"] / counters["requests"], 6) if counters["requests"] else None,
+                        "max": round(counters["latencyMax"], 6),
+                        "buckets": buckets
+                    }
+                }
+
+            now = time.monotonic()
+            phases = {}
+            for phase, state in self.phases.items():
+                # A phase still running (eg. the run failed) counts until now
+                seconds = state["seconds"] + (now - state["start"] if state["start"] is not None else 0)
+                phases[phase] = {
+                    "seconds": round(seconds, 3),
+                    "items": dict(state["items"]),
+                    "throughput": {item: round(count / seconds, 3) if seconds > 0 else None for item, count in state["items"].items()}
+                }
+
+        return {"endpoints": endpoints, "phases": phases}
+
+    # Write basename + ".metrics.json" and basename + ".prom" (Prometheus textfile format)
+    def write(self, basename):
+        summary = self.getSummary()
+
+        with open(basename + ".metrics.json", "w", encoding="utf-8") as fmetrics:
+            json.dump(summary, fmetrics, indent=2)
+
+        lines = []
+        lines.append("# HELP odysee_requests_total Requests sent, by endpoint and status (error when the request raised)")
+        lines.append("# TYPE odysee_requests_total counter")
+        for endpoint, counters in summary["endpoints"].items():
+            for status, count in counters["statuses"].items():
+                lines.append(f'odysee_requests_total{{endpoint="{escape(endpoint)}",status="{status}"}} {count}')
+            if counters["errors"]:
+                lines.append(f'odysee_requests_total{{endpoint="{escape(endpoint)}",status="error"}} {counters["errors"]}')
+        lines.append("# HELP odysee_response_bytes_total Bytes of response bodies, by endpoint")
+        lines.append("# TYPE odysee_response_bytes_total counter")
+        for endpoint, counters in summary["endpoints"].items():
+            lines.append(f'odysee_response_bytes_total{{endpoint="{escape(endpoint)}"}} {counters["bytes"]}')
+        lines.append("# HELP odysee_retries_total Retries of transient failures, by endpoint")
+        lines.append("# TYPE odysee_retries_total counter")
+        for endpoint, counters in summary["endpoints"].items():
+            lines.append(f'odysee_retries_total{{endpoint="{escape(endpoint)}"}} {counters["retries"]}')
+        lines.append("# HELP odysee_request_duration_seconds Latency of requests, by endpoint")
+        lines.append("# TYPE odysee_request_duration_seconds histogram")
+        for endpoint, counters in summary["endpoints"].items():
+            for bound, count in counters["latency"]["buckets"].items():
+                lines.append(f'odysee_request_duration_seconds_bucket{{endpoint="{escape(endpoint)}",le="{bound}"}} {count}')
+            lines.append(f'odysee_request_duration_seconds_sum{{endpoint="{escape(endpoint)}"}} {counters["latency"]["sum"]}')
+            lines.append(f'odysee_request_duration_seconds_count{{endpoint="{escape(endpoint)}"}} {counters["requests"]}')
+        lines.append("# HELP odysee_phase_duration_seconds Duration of each phase of the run")
+        lines.append("# TYPE odysee_phase_duration_seconds gauge")
+        for phase, state in summary["phases"].items():
+            lines.append(f'odysee_phase_duration_seconds{{phase="{escape(phase)}"}} {state["seconds"]}')
+        lines.append("# HELP odysee_phase_items_total Items handled in each phase")
+        lines.append("# TYPE odysee_phase_items_total counter")
+        for phase, state in summary["phases"].items():
+            for item, count in state["items"].items():
+                lines.append(f'odysee_phase_items_total{{phase="{escape(phase)}",item="{escape(item)}"}} {count}')
+
+        # Written to a temporary file and renamed, node_exporter never reads a partial file
+        with open(basename + ".prom.tmp", "w", encoding="utf-8") as fprom:
+            fprom.write("\n".join(lines) + "\n")
+        os.replace(basename + ".prom.tmp", basename + ".prom")
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,332 @@
+# -*- encoding: utf-8 -*-
+
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import bisect, hashlib, json, random, threading, time
+
+# Local stand-in of the Odysee APIs used by videos.py and comment.py, serving synthetic channels
+# Requests are expected on http://<host>:<port>/<Odysee host>/<path>, as sent by HttpClient with baseUrl
+# Responses have the shapes parsed by the exporters (claim_search, comment.List, file/view_count, reaction/list, user/new, thumbnails)
+class MockOdysee():
+    def __init__(self, channels=1, claimsPerChannel=10000, repostRatio=0.1, commentsPerChannel=1000000, replyRatio=0.6,
+                 commenters=5000, latency=0.0, latencyJitter=0.0, errorRate=0.0, seed=1):
+        self.latency = latency
+        self.latencyJitter = latencyJitter
+        self.errorRate = errorRate
+        self.replyRatio = replyRatio
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = {}                   # endpoint -> number of requests served
+        self.commentsCache = OrderedDict()   # claim_id -> comments newest first, for the last claims asked
+        self.commentsCacheSize = 64
+
+        # Commenters' channels, one in ten has no title and one in fifty is unknown to claim_search
+        self.commenters = [makeId(seed, "commenter", num) for num in range(commenters)]
+        self.commenterTitles = {}
+        for num, channel_id in enumerate(self.commenters):
+            if num % 50 != 0:
+                self.commenterTitles[channel_id] = None if num % 10 == 0 else "Commenter " + str(num)
+
+        self.channels = {}         # channel_id -> claims sorted by release_time, newest first
+        self.releaseTimes = {}     # channel_id -> release_times of claims, oldest first, for release_time constraints
+        self.commentsCount = {}    # claim_id of the commented claim -> number of comments
+        for channelNum in range(channels):
+            channel_id = makeId(seed, "channel", channelNum)
+            self.channels[channel_id] = self.makeClaims(channel_id, channelNum, claimsPerChannel, repostRatio, commentsPerChannel)
+            self.releaseTimes[channel_id] = sorted(getReleaseTime(claim) for claim in self.channels[channel_id])
+
+    def makeClaims(self, channel_id, channelNum, claimsCount, repostRatio, commentsCount):
+        rng = random.Random(channel_id)
+        claims = []
+        releaseTime = 1500000000
+        for num in range(claimsCount):
+            releaseTime = releaseTime + rng.randint(600, 86400)
+            claim_id = makeId(self.seed, channel_id, num)
+            video = {
+                "title": "Video " + str(num),
+                "description": "Description of video " + str(num),
+                "video": {"duration": rng.randint(5, 4 * 3600)},
+                "thumbnail": {"url": "https://thumbnails.odycdn.com/" + claim_id + ".webp"}
+            }
+            claim = {
+                "claim_id": claim_id,
+                "canonical_url": "lbry://@channel" + str(channelNum) + "#" + channel_id[0] + "/video-" + str(num) + "#" + claim_id[0],
+                "timestamp": releaseTime + rng.randint(0, 3600),
+                "value_type": "stream",
+                "value": video
+            }
+            # Some claims have no release_time, their timestamp is used
+            if num % 7 != 0:
+                claim["release_time"] = releaseTime
+                video["release_time"] = str(releaseTime)
+            if rng.random() < repostRatio:
+                original_id = makeId(self.seed, "original", channel_id, num)
+                claim["value_type"] = "repost"
+                claim["value"] = {}
+                claim["reposted_claim"] = {
+                    "claim_id": original_id,
+                    "canonical_url": "lbry://@other#o/original-" + str(num) + "#" + original_id[0],
+                    "timestamp": releaseTime - rng.randint(3600, 30 * 86400),
+                    "value_type": "stream",
+                    "value": dict(video, title="Original " + str(num)),
+                    "signing_channel": {"canonical_url": "lbry://@other#o", "claim_id": makeId(self.seed, "other")}
+                }
+            claims.append(claim)
+
+        # Comments are shared between claims with a long tail : a few claims have most of them
+        weights = [1 / (rank + 1) ** 0.8 for rank in range(claimsCount)]
+        rng.shuffle(weights)
+        totalWeight = sum(weights)
+        for claim, weight in zip(claims, weights):
+            self.commentsCount[getCommentedId(claim)] = int(commentsCount * weight / totalWeight)
+
+        claims.reverse()
+        return claims
+
+    # Comments of a claim newest first, generated again from the claim_id when they aren't in the cache
+    def getComments(self, claim_id):
+        with self.lock:
+            comments = self.commentsCache.get(claim_id)
+            if comments is not None:
+                self.commentsCache.move_to_end(claim_id)
+                return comments
+
+        rng = random.Random(claim_id)
+        comments = []
+        timestamp = 1500000000
+        for num in range(self.commentsCount.get(claim_id, 0)):
+            timestamp = timestamp + rng.randint(1, 3600)
+            channel_id = rng.choice(self.commenters)
+            comment = {
+                "comment": "Comment " + str(num) + " on " + claim_id[:8] + ("\nsecond line" if num % 9 == 0 else ""),
+                "comment_id": makeId(self.seed, claim_id, "comment", num),
+                "claim_id": claim_id,
+                "timestamp": timestamp,
+                "signature": "00",
+                "signing_ts": str(timestamp),
+                "channel_id": channel_id,
+                "channel_name": "@commenter",
+                "channel_url": "lbry://@commenter#" + channel_id,
+                "is_hidden": False,
+                "is_pinned": False,
+                "is_fiat": False
+            }
+            # Replies go to recent comments, so threads get deep
+            if comments and rng.random() < self.replyRatio:
+                parent = comments[max(0, len(comments) - 1 - int(rng.expovariate(0.2)))]
+                comment["parent_id"] = parent["comment_id"]
+                parent["replies"] = parent.get("replies", 0) + 1
+            comments.append(comment)
+        comments.reverse()
+
+        with self.lock:
+            self.commentsCache[claim_id] = comments
+            if len(self.commentsCache) > self.commentsCacheSize:
+                self.commentsCache.popitem(last=False)
+
+        return comments
+
+    def claimSearch(self, params):
+        page = params.get("page", 1)
+        pageSize = min(params.get("page_size", 20), 50)
+
+        if "claim_ids" in params:
+            items = []
+            for claim_id in params["claim_ids"]:
+                if claim_id in self.channels:
+                    items.append({"claim_id": claim_id, "canonical_url": "lbry://@channel#" + claim_id[0], "value": {"title": "Channel " + claim_id[:8]}})
+                elif claim_id in self.commenterTitles:
+                    title = self.commenterTitles[claim_id]
+                    items.append({"claim_id": claim_id, "canonical_url": "lbry://@commenter#" + claim_id[0], "value": {"title": title} if title is not None else {}})
+            return pageResult(items, page, pageSize)
+
+        claims = []
+        for channel_id in params.get("channel_ids", []):
+            claims.extend(self.filterReleaseTime(channel_id, params.get("release_time")))
+        return pageResult(claims, page, pageSize)
+
+    # Claims of a channel within release_time constraints (eg. [">=1600000000", "<1700000000"]), newest first
+    def filterReleaseTime(self, channel_id, constraints):
+        claims = self.channels.get(channel_id, [])
+        if not constraints:
+            return claims
+
+        if isinstance(constraints, str):
+            constraints = [constraints]
+        releaseTimes = self.releaseTimes[channel_id]
+        low, high = 0, len(releaseTimes)
+        for constraint in constraints:
+            operator = constraint.rstrip("0123456789")
+            value = int(constraint[len(operator):])
+            if operator == ">=":
+                low = max(low, bisect.bisect_left(releaseTimes, value))
+            elif operator == ">":
+                low = max(low, bisect.bisect_right(releaseTimes, value))
+            elif operator == "<":
+                high = min(high, bisect.bisect_left(releaseTimes, value))
+            elif operator == "<=":
+                high = min(high, bisect.bisect_right(releaseTimes, value))
+        if low >= high:
+            return []
+
+        # claims are newest first, releaseTimes oldest first
+        return claims[len(claims) - high:len(claims) - low]
+
+    def commentList(self, params):
+        comments = self.getComments(params["claim_id"])
+        pageSize = min(params.get("page_size", 50), 600)
+        page = params.get("page", 1)
+        result = {
+            "page": page,
+            "page_size": pageSize,
+            "total_items": len(comments),
+            "total_pages": -(-len(comments) // pageSize),
+            "has_hidden_comments": False
+        }
+        # items is missing when the page is empty
+        items = comments[(page - 1) * pageSize:page * pageSize]
+        if items:
+            result["items"] = items
+
+        return result
+
+    # Build the response of a request, as (status, content type, body)
+    def handle(self, method, path, query, body):
+        parts = path.lstrip("/").split("/", 1)
+        host, route = parts[0], "/" + (parts[1] if len(parts) > 1 else "")
+        if host == "__stats":
+            return 200, "application/json", json.dumps(self.getStats()).encode()
+
+        endpoint = host + route + ("?m=" + query["m"][0] if "m" in query else "")
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+        if self.latency > 0 or self.latencyJitter > 0:
+            time.sleep(self.latency + self.rng.random() * self.latencyJitter)
+        if self.errorRate > 0 and self.rng.random() < self.errorRate:
+            return 503, "application/json", b'{"error": "Service Unavailable"}'
+
+        if host == "thumbnails.odycdn.com":
+            return 200, "image/webp", b"RIFF\x00\x00\x00\x00WEBP"
+
+        if route == "/api/v1/proxy" or route == "/api/v2":
+            rpc = json.loads(body)
+            if rpc["method"] == "claim_search":
+                return jsonResponse({"jsonrpc": "2.0", "id": rpc.get("id"), "result": self.claimSearch(rpc["params"])})
+            if rpc["method"] == "comment.List":
+                return jsonResponse({"jsonrpc": "2.0", "id": rpc.get("id"), "result": self.commentList(rpc["params"])})
+            return jsonResponse({"jsonrpc": "2.0", "id": rpc.get("id"), "error": {"code": -32601, "message": "method not found"}})
+
+        form = parse_qs(body.decode()) if body else {}
+        if route == "/file/view_count":
+            claim_ids = form["claim_id"][0].split(",")
+            return jsonResponse({"success": True, "error": None, "data": [int(claim_id[:6], 16) % 100000 for claim_id in claim_ids]})
+        if route == "/reaction/list":
+            claim_ids = form["claim_ids"][0].split(",")
+            others_reactions = {claim_id: {"like": int(claim_id[6:9], 16) % 1000, "dislike": int(claim_id[9:11], 16) % 100} for claim_id in claim_ids}
+            return jsonResponse({"success": True, "error": None, "data": {"others_reactions": others_reactions}})
+        if route == "/user/new":
+            return jsonResponse({"success": True, "error": None, "data": {"id": 1, "auth_token": makeId(self.seed, "auth_token")}})
+
+        return 404, "application/json", b'{"error": "Not Found"}'
+
+    # Served requests and size of channels, for benchmarks (also served on /__stats)
+    def getStats(self):
+        with self.lock:
+            requests = dict(self.requests)
+
+        channels = {}
+        for channel_id, claims in self.channels.items():
+            channels[channel_id] = {"claims": len(claims), "comments": sum(self.commentsCount[getCommentedId(claim)] for claim in claims)}
+
+        return {"requests": requests, "channels": channels}
+
+    # Serve in a background thread, return the base url to give to HttpClient
+    def start(self, host="127.0.0.1", port=0):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are sent by two writes, without this a keep-alive client waits for the delayed ACK of each response
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                self.respond(b"")
+
+            def do_POST(self):
+                self.respond(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+
+            def respond(self, body):
+                parts = urlsplit(self.path)
+                status, contentType, content = mock.handle(self.command, parts.path, parse_qs(parts.query), body)
+                self.send_response(status)
+                self.send_header("Content-Type", contentType)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        return "http://" + host + ":" + str(self.server.server_address[1])
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def makeId(*parts):
+    return hashlib.sha1("-".join(str(part) for part in parts).encode()).hexdigest()
+
+def getReleaseTime(claim):
+    return claim.get("release_time", claim["timestamp"])
+
+# Comments of a repost are on the original content
+def getCommentedId(claim):
+    if claim["value_type"] == "repost":
+        return claim["reposted_claim"]["claim_id"]
+
+    return claim["claim_id"]
+
+def pageResult(items, page, pageSize):
+    return {
+        "items": items[(page - 1) * pageSize:page * pageSize],
+        "page": page,
+        "page_size": pageSize,
+        "total_items": len(items),
+        "total_pages": -(-len(items) // pageSize)
+    }
+
+def jsonResponse(obj):
+    return 200, "application/json", json.dumps(obj).encode()
+
+if __name__ == "__main__":
+    # Synthetic channels
+    channels = 1
+    claimsPerChannel = 10000
+    repostRatio = 0.1 # Share of claims that are reposts
+    commentsPerChannel = 1000000
+    replyRatio = 0.6 # Share of comments that are replies
+
+    # Faults
+    latency = 0.0 # Seconds added to each response
+    latencyJitter = 0.0 # Up to this number of seconds added at random to latency
+    errorRate = 0.0 # Share of requests answered by a 503
+
+    # Server
+    host = "127.0.0.1"
+    port = 8080
+
+    mock = MockOdysee(channels, claimsPerChannel, repostRatio, commentsPerChannel, replyRatio, latency=latency, latencyJitter=latencyJitter, errorRate=errorRate)
+    baseUrl = mock.start(host, port)
+    print("Serving on " + baseUrl + ", channels : " + ", ".join(mock.channels))
+    try:
+        mock.thread.join()
+    except KeyboardInterrupt:
+        mock.stop()
@@ -0,0 +1,58 @@
+# -*- encoding: utf-8 -*-
+
+import queue, threading
+
+# Page through claim_search in a background thread, ahead of the claims being handled
+# getPage(page) returns the "result" of a claim_search call, with its items and total_pages
+# At most maxPages pages wait in the queue : when the consumer is slower, the producer waits instead of filling memory
+# onError is called in the consumer thread when getting a page failed, by default the error is raised again
+# Pages before startPage aren't fetched (eg. they were handled by an interrupted export)
+class PagePrefetcher():
+    def __init__(self, getPage, maxPages=2, onError=None, startPage=1):
+        self.getPage = getPage
+        self.startPage = startPage
+        self.onError = onError
+        self.pages = queue.Queue(maxsize=maxPages)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.produce, daemon=True)
+
+    def put(self, entry):
+        # Wake up regularly so the producer ends when the consumer stopped reading
+        while not self.stopped.is_set():
+            try:
+                self.pages.put(entry, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(self):
+        try:
+            page = self.startPage
+            total_pages = self.startPage
+            while page <= total_pages:
+                result = self.getPage(page)
+                total_pages = result.get('total_pages')
+                if not self.put(("page", result)):
+                    return
+                page = page + 1
+            self.put(("end", None))
+        except BaseException as e:
+            # Errors (including exitProgram's SystemExit) are handed to the consumer thread
+            self.put(("error", e))
+
+    def __iter__(self):
+        self.thread.start()
+        try:
+            while True:
+                kind, value = self.pages.get()
+                if kind == "end":
+                    return
+                if kind == "error":
+                    if self.onError is None:
+                        raise value
+                    self.onError()
+                    return
+                yield value
+        finally:
+            self.stopped.set()
@@ -0,0 +1,186 @@
+# -*- encoding: utf-8 -*-
+
+import cProfile, io, pstats, threading, time, tracemalloc
+
+# CPU and allocations of each phase of an export (eg. "listing", "fetch", "tree", "render", "write")
+# Each phase has its own cProfile profile, enabled only while the phase runs : time of a nested phase isn't counted in the enclosing one
+# tracemalloc gives the peak and retained memory of each phase, and every snapshotInterval entries of a phase
+# snapshots taken when it starts and ends give the lines that allocated during the phase
+# Only the thread that started the profiler is profiled, phases entered from other threads are ignored
+# tracemalloc traces the whole process : allocations of background threads (eg. pages fetched ahead) are counted in the phase running meanwhile
+# It is started by the first profiler started and stopped by the last one stopped, so programs of batch.py can be profiled together
+class Profiler():
+    def __init__(self, snapshotInterval=100, topLines=30):
+        self.snapshotInterval = snapshotInterval
+        self.topLines = topLines
+        self.thread = None
+        self.phases = {}      # name -> Phase
+        self.stack = []       # Entries of the phases running, innermost last
+
+    def start(self):
+        self.thread = threading.current_thread()
+        TRACING.acquire()
+
+    def stop(self):
+        if threading.current_thread() is not self.thread:
+            return
+        while self.stack:
+            self.exit()
+        self.thread = None
+        TRACING.release()
+
+    # with profiler.phase("render"): ...
+    def phase(self, name):
+        if threading.current_thread() is not self.thread:
+            return NO_PHASE
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = Phase(self, name)
+
+        return phase
+
+    # Items of iterable, each next() counted in phase name (eg. pages fetched in background and waited for)
+    def iterate(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                item = next(iterator, END)
+            if item is END:
+                return
+            yield item
+
+    def enter(self, phase):
+        outer = self.stack[-1] if self.stack else None
+        # Phase entered again inside itself (eg. recursion), it keeps running
+        if outer is not None and outer['phase'] is phase:
+            self.stack.append({"phase": phase, "nested": True})
+            return
+        if outer is not None:
+            self.pause(outer)
+
+        phase.entries = phase.entries + 1
+        snapshot = None
+        if (phase.entries - 1) % self.snapshotInterval == 0:
+            snapshot = tracemalloc.take_snapshot()
+        entry = {"phase": phase, "nested": False, "base": tracemalloc.get_traced_memory()[0], "snapshot": snapshot}
+        self.stack.append(entry)
+        self.resume(entry)
+
+    def exit(self):
+        entry = self.stack.pop()
+        if entry['nested'] is True:
+            return
+
+        phase = entry['phase']
+        self.pause(entry)
+        phase.retained = phase.retained + tracemalloc.get_traced_memory()[0] - entry['base']
+        if entry['snapshot'] is not None:
+            phase.addAllocations(tracemalloc.take_snapshot().compare_to(entry['snapshot'], "lineno"))
+
+        if self.stack:
+            self.resume(self.stack[-1])
+
+    def resume(self, entry):
+        tracemalloc.reset_peak()
+        entry['start'] = time.perf_counter()
+        entry['phase'].profile.enable()
+
+    def pause(self, entry):
+        phase = entry['phase']
+        phase.profile.disable()
+        phase.seconds = phase.seconds + time.perf_counter() - entry['start']
+        phase.peak = max(phase.peak, tracemalloc.get_traced_memory()[1] - entry['base'])
+
+    # Write basename + ".profile.txt" with the report of each phase, and basename + ".<phase>.pstats" for pstats or snakeviz
+    def write(self, basename):
+        running = {entry['phase'] for entry in self.stack}
+        with open(basename + ".profile.txt", "w", encoding="utf-8") as freport:
+            for name, phase in self.phases.items():
+                freport.write(f"Phase {name} : {phase.entries} entries, {phase.seconds:.3f}s, peak {phase.peak / 1024:.1f} KiB, retained {phase.retained / 1024:.1f} KiB\n")
+                # A profile still enabled (eg. the run failed in another thread) can't be read
+                if phase in running:
+                    freport.write("Still running, not reported\n\n")
+                    continue
+
+                stream = io.StringIO()
+                try:
+                    stats = pstats.Stats(phase.profile, stream=stream)
+                except TypeError:
+                    # Phase without any profiled call
+                    freport.write("No call profiled\n\n")
+                    continue
+                stats.sort_stats("tottime").print_stats(self.topLines)
+                stats.sort_stats("cumulative").print_stats(self.topLines)
+                freport.write(stream.getvalue())
+                stats.dump_stats(basename + "." + name + ".pstats")
+
+                freport.write(f"Allocations of {phase.snapshots} snapshots, by line :\n")
+                allocations = sorted(phase.allocations.items(), key=lambda allocation: allocation[1][0], reverse=True)
+                for line, (size, count) in allocations[:self.topLines]:
+                    freport.write(f"{size / 1024:>12.1f} KiB {count:>10} blocks  {line}\n")
+                freport.write("\n")
+
+class Phase():
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.profile = cProfile.Profile()
+        self.entries = 0
+        self.seconds = 0.0
+        self.peak = 0
+        self.retained = 0
+        self.snapshots = 0
+        self.allocations = {}     # "file:line" -> [size, count] allocated between snapshots
+
+    def addAllocations(self, statistics):
+        self.snapshots = self.snapshots + 1
+        for statistic in statistics:
+            if statistic.size_diff <= 0:
+                continue
+            frame = statistic.traceback[0]
+            # Snapshots taken by the profiler itself aren't allocations of the phase
+            if frame.filename in (tracemalloc.__file__, __file__):
+                continue
+            allocation = self.allocations.setdefault(f"{frame.filename}:{frame.lineno}", [0, 0])
+            allocation[0] = allocation[0] + statistic.size_diff
+            allocation[1] = allocation[1] + statistic.count_diff
+
+    def __enter__(self):
+        self.profiler.enter(self)
+
+    def __exit__(self, excType, exc, traceback):
+        self.profiler.exit()
+
+# tracemalloc shared by the profilers running, it is left running when something else started it (eg. python -X tracemalloc)
+class Tracing():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.profilers = 0
+        self.started = False
+
+    def acquire(self):
+        with self.lock:
+            if self.profilers == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started = True
+            self.profilers = self.profilers + 1
+
+    def release(self):
+        with self.lock:
+            self.profilers = self.profilers - 1
+            if self.profilers == 0 and self.started is True:
+                tracemalloc.stop()
+                self.started = False
+
+TRACING = Tracing()
+
+# Phase of profilers not started, or entered from threads not profiled
+class NoPhase():
+    def __enter__(self):
+        pass
+
+    def __exit__(self, excType, exc, traceback):
+        pass
+
+NO_PHASE = NoPhase()
+END = object()
@@ -0,0 +1,12 @@
+# -*- encoding: utf-8 -*-
+
+import sqlite3
+
+# Connection to a SQLite file of statestore.py or archive.py, in WAL mode so readers (eg. queries of the archive) don't block writes
+# Connections are used by the thread running main, clean can close it from another thread
+def openDatabase(filename):
+    connection = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+
+    return connection
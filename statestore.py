@@ -0,0 +1,98 @@
+# -*- encoding: utf-8 -*-
+
+import time
+from sqlitedb import openDatabase
+
+# Claims of channels and their stats at each run, kept in a SQLite file between runs
+# Metadata of a claim is written again only when claim_search shows it was updated, stats are added at each run so past values stay queryable
+class StateStore():
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = openDatabase(filename)
+        self.createTables()
+        # All stats of a run have the same fetched_at
+        self.runAt = int(time.time())
+
+    def createTables(self):
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS claims (
+                    claim_id TEXT PRIMARY KEY,
+                    channel_id TEXT NOT NULL,
+                    stats_claim_id TEXT NOT NULL,
+                    claim_type TEXT,
+                    url TEXT,
+                    title TEXT,
+                    description TEXT,
+                    duration TEXT,
+                    release_time INTEGER,
+                    updated_at INTEGER,
+                    reposted_updated_at INTEGER,
+                    first_seen INTEGER NOT NULL,
+                    last_seen INTEGER NOT NULL
+                )""")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS stats (
+                    claim_id TEXT NOT NULL,
+                    fetched_at INTEGER NOT NULL,
+                    views INTEGER,
+                    likes INTEGER,
+                    dislikes INTEGER,
+                    comments INTEGER,
+                    PRIMARY KEY (claim_id, fetched_at)
+                ) WITHOUT ROWID""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS claims_channel ON claims (channel_id, release_time)")
+
+    # claim_ids of claimsInfos whose metadata changed since it was stored, or never stored
+    # claim_search gives the timestamp of the last update of a claim (and of the reposted claim), stored ones are read by chunks of 500 claim_ids
+    def changedClaims(self, claimsInfos):
+        stored = {}
+        claim_ids = [claimInfos['claim_id'] for claimInfos in claimsInfos]
+        for start in range(0, len(claim_ids), 500):
+            chunk = claim_ids[start:start + 500]
+            rows = self.connection.execute("SELECT claim_id, updated_at, reposted_updated_at FROM claims WHERE claim_id IN (" + ",".join("?" * len(chunk)) + ")", chunk)
+            for claim_id, updated_at, reposted_updated_at in rows:
+                stored[claim_id] = (updated_at, reposted_updated_at)
+
+        changed = set()
+        for claimInfos in claimsInfos:
+            if stored.get(claimInfos['claim_id']) != (claimInfos['timestamp'], claimInfos['reposted_timestamp']):
+                changed.add(claimInfos['claim_id'])
+
+        return changed
+
+    # Write metadata of changed claims and stats of all claims of a page in one transaction
+    def writePage(self, channel_id, claimsInfos, pageStats, changed):
+        claimsRows = []
+        seenRows = []
+        statsRows = []
+        for claimInfos, stats in zip(claimsInfos, pageStats):
+            claim_id = claimInfos['claim_id']
+            if claim_id in changed:
+                claimsRows.append((claim_id, channel_id, claimInfos['claim_id_additionnalreq'], claimInfos['claim_type'], claimInfos['url'], claimInfos['title'],
+                                   claimInfos['description'], claimInfos['durationString'], claimInfos['release_time'], claimInfos['timestamp'], claimInfos['reposted_timestamp'],
+                                   self.runAt, self.runAt))
+            else:
+                seenRows.append((self.runAt, claim_id))
+            reactions = stats['reactions']
+            statsRows.append((claim_id, self.runAt, stats['viewCount'], reactions['likeCount'], reactions['dislikeCount'], stats['commentCount']))
+
+        with self.connection:
+            self.connection.executemany("""
+                INSERT INTO claims VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (claim_id) DO UPDATE SET
+                    channel_id = excluded.channel_id, stats_claim_id = excluded.stats_claim_id, claim_type = excluded.claim_type, url = excluded.url,
+                    title = excluded.title, description = excluded.description, duration = excluded.duration, release_time = excluded.release_time,
+                    updated_at = excluded.updated_at, reposted_updated_at = excluded.reposted_updated_at, last_seen = excluded.last_seen""", claimsRows)
+            self.connection.executemany("UPDATE claims SET last_seen = ? WHERE claim_id = ?", seenRows)
+            self.connection.executemany("INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?, ?, ?)", statsRows)
+
+    # Stats of a claim at each run, oldest first
+    def getHistory(self, claim_id):
+        rows = self.connection.execute("SELECT fetched_at, views, likes, dislikes, comments FROM stats WHERE claim_id = ? ORDER BY fetched_at", (claim_id,))
+
+        return [{"fetchedAt": fetched_at, "viewCount": views, "likeCount": likes, "dislikeCount": dislikes, "commentCount": comments}
+                for fetched_at, views, likes, dislikes, comments in rows]
+
+    def close(self):
+        self.connection.close()
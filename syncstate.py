@@ -0,0 +1,89 @@
+# -*- encoding: utf-8 -*-
+
+import json, os, threading, time
+
+# State of the comments of each claim at the last export, so the next export only fetches what changed
+# For each claim : comment_id and timestamp of the newest comment, and total_items given by comment.List
+class CommentSyncState():
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+
+        self.claims = {}         # claim_id -> {"newest_comment_id", "newest_timestamp", "total_items"}
+        self.updated = {}        # claim_id -> state of the claim, for claims updated by this export
+        self.lastExport = None   # timestamp of the start of the last export
+        self.exportStart = time.time()
+
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+
+        with open(self.filename, "r", encoding="utf-8") as fstate:
+            state = json.load(fstate)
+
+        self.claims = state['claims']
+        self.lastExport = state['lastExport']
+
+    def save(self):
+        with self.lock:
+            state = {"lastExport": self.exportStart, "claims": dict(self.claims)}
+
+        # Write a temporary file and replace, a crash while saving doesn't lose the previous state
+        tmpfilename = self.filename + "." + str(threading.get_ident()) + ".tmp"
+        with open(tmpfilename, "w", encoding="utf-8") as fstate:
+            json.dump(state, fstate)
+        os.replace(tmpfilename, self.filename)
+
+    # Claims updated by this export and its start, saved in the checkpoint of comment.py
+    # An interrupted export resumed later keeps the states of the claims written before the checkpoint
+    def getUpdates(self):
+        with self.lock:
+            return {"exportStart": self.exportStart, "claims": dict(self.updated)}
+
+    def restoreUpdates(self, updates):
+        with self.lock:
+            self.exportStart = updates['exportStart']
+            self.claims.update(updates['claims'])
+            self.updated.update(updates['claims'])
+
+    def get(self, claim_id):
+        with self.lock:
+            return self.claims.get(claim_id)
+
+    # commentsRequest is the first page of comment.List sorted newest first
+    def update(self, claim_id, commentsRequest):
+        items = commentsRequest.get('items', [])
+        newest = items[0] if items else {}
+        state = {
+            "newest_comment_id": newest.get('comment_id'),
+            "newest_timestamp": newest.get('timestamp'),
+            "total_items": commentsRequest.get('total_items', 0)
+        }
+        with self.lock:
+            self.claims[claim_id] = state
+            self.updated[claim_id] = state
+
+    # True when the first page of comment.List shows the same newest comment and number of comments as the last export
+    def unchanged(self, claim_id, commentsRequest):
+        state = self.get(claim_id)
+        if state is None:
+            return False
+
+        items = commentsRequest.get('items', [])
+        newest_comment_id = items[0].get('comment_id') if items else None
+
+        return state['total_items'] == commentsRequest.get('total_items', 0) and state['newest_comment_id'] == newest_comment_id
+
+    # True when comment is newer than the newest comment of the last export
+    # Comments are sorted newest first, paging stops at the first comment which isn't new
+    def isNew(self, claim_id, comment):
+        state = self.get(claim_id)
+        if state is None or state['newest_comment_id'] is None:
+            return True
+        if comment['comment_id'] == state['newest_comment_id']:
+            return False
+
+        # The newest comment of the last export may have been deleted since
+        return comment['timestamp'] >= state['newest_timestamp']
@@ -0,0 +1,64 @@
+# -*- encoding: utf-8 -*-
+
+import gc, logging, time
+import pytest
+from mockserver import MockOdysee
+from httpclient import HttpClient, RetryPolicy
+import videos
+
+DATE_FORMATS = {"dateString": "%d/%m/%Y %H:%M:%S", "dateDBString": "%Y-%m-%d %H:%M:%S", "dateFileString": "%d%m%Y%H%M%S"}
+
+# Mock server answering 503 to every request for which failing(path, body) is True
+class FailingMock(MockOdysee):
+    def __init__(self, failing, **options):
+        MockOdysee.__init__(self, **options)
+        self.failing = failing
+
+    def handle(self, method, path, query, body):
+        if self.failing(path, body):
+            with self.lock:
+                self.requests["failed"] = self.requests.get("failed", 0) + 1
+            return 503, "application/json", b'{"error": "Service Unavailable"}'
+
+        return MockOdysee.handle(self, method, path, query, body)
+
+    def countRequests(self):
+        with self.lock:
+            return sum(self.requests.values())
+
+def failViewCounts(path, body):
+    return path.endswith("/file/view_count")
+
+# Pages of release_time shards, the claim_search of initChannel succeeds
+def failShards(path, body):
+    return b"release_time" in body
+
+@pytest.mark.parametrize("options,failing", [
+    ({"useAsync": True}, failViewCounts),
+    ({"shardClaims": True}, failShards),
+    ({"useAsync": True, "shardClaims": True}, failShards),
+])
+def test_failing_export_stops_cleanly(tmp_path, monkeypatch, caplog, options, failing):
+    monkeypatch.chdir(tmp_path)
+    mock = FailingMock(failing, claimsPerChannel=300, commentsPerChannel=1000, commenters=50)
+    baseUrl = mock.start()
+    client = HttpClient(20, baseUrl=baseUrl, retryPolicy=RetryPolicy(maxRetries=3, backoffBase=0.05))
+    try:
+        program = videos.Program(next(iter(mock.channels)), "", False, "Europe/Paris", DATE_FORMATS, client=client, exitProcess=False, **options)
+        with pytest.raises(SystemExit):
+            program.main()
+
+        # Calls in flight end at once, nothing is sent after the program stopped
+        time.sleep(0.3)
+        requests = mock.countRequests()
+        time.sleep(1)
+        assert mock.countRequests() == requests
+        assert mock.requests["failed"] > 0
+
+        gc.collect()
+        assert not [record for record in caplog.records if record.name == "asyncio" and record.levelno >= logging.ERROR]
+        with open(program.loggingfile.name, encoding="utf-8") as flog:
+            assert "Execution had errors" in flog.read()
+    finally:
+        client.close()
+        mock.stop()
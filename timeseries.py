@@ -0,0 +1,107 @@
+# -*- encoding: utf-8 -*-
+
+import mmap, struct
+from array import array
+
+# Append-only file of view/like/dislike counts of claims, with fixed-width binary records
+# Header : magic, version, record size. Record : timestamp, claim_id (20 bytes), viewCount, likeCount, dislikeCount
+# Missing counts (eg. auth_token couldn't be retrieved) are stored as -1
+MAGIC = b"ODTS"
+VERSION = 1
+HEADER = struct.Struct("<4sHH")
+RECORD = struct.Struct("<q20sqii")
+
+class TimeSeriesWriter():
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, "ab")
+
+        size = self.file.tell()
+        if size == 0:
+            self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+            self.file.flush()
+        else:
+            checkHeader(filename)
+            # A record cut by a crash is dropped, so records stay aligned
+            partial = (size - HEADER.size) % RECORD.size
+            if partial != 0:
+                self.file.truncate(size - partial)
+
+    # samples : list of (claim_id, viewCount, likeCount, dislikeCount) polled at timestamp, written at once
+    def append(self, timestamp, samples):
+        buffer = bytearray(RECORD.size * len(samples))
+        for num, (claim_id, viewCount, likeCount, dislikeCount) in enumerate(samples):
+            RECORD.pack_into(buffer, num * RECORD.size, timestamp, bytes.fromhex(claim_id),
+                             missing(viewCount), missing(likeCount), missing(dislikeCount))
+        self.file.write(buffer)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def missing(count):
+    return -1 if count is None else count
+
+def checkHeader(filename):
+    with open(filename, "rb") as ftimeseries:
+        header = ftimeseries.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError(f"{filename} isn't a time series file")
+    magic, version, recordSize = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION or recordSize != RECORD.size:
+        raise ValueError(f"{filename} isn't a time series file of version {VERSION}")
+
+# Records are read from a memory map of the file, without parsing text
+class TimeSeriesReader():
+    def __init__(self, filename):
+        checkHeader(filename)
+        self.file = open(filename, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        # Records written after the reader was opened aren't seen, a record cut by a crash is ignored
+        self.count = (len(self.map) - HEADER.size) // RECORD.size
+        self.data = memoryview(self.map)[HEADER.size:HEADER.size + self.count * RECORD.size]
+
+    def __len__(self):
+        return self.count
+
+    # (timestamp, claim_id, viewCount, likeCount, dislikeCount) in order of writing, -1 for missing counts
+    def __iter__(self):
+        for timestamp, claim_id, viewCount, likeCount, dislikeCount in RECORD.iter_unpack(self.data):
+            yield timestamp, claim_id.hex(), viewCount, likeCount, dislikeCount
+
+    # All records as columns : arrays of timestamps and counts, and the list of raw 20 bytes claim_ids
+    def columns(self):
+        timestamps = array("q")
+        claim_ids = []
+        viewCounts = array("q")
+        likeCounts = array("i")
+        dislikeCounts = array("i")
+        for timestamp, claim_id, viewCount, likeCount, dislikeCount in RECORD.iter_unpack(self.data):
+            timestamps.append(timestamp)
+            claim_ids.append(claim_id)
+            viewCounts.append(viewCount)
+            likeCounts.append(likeCount)
+            dislikeCounts.append(dislikeCount)
+
+        return {"timestamp": timestamps, "claim_id": claim_ids, "viewCount": viewCounts, "likeCount": likeCounts, "dislikeCount": dislikeCounts}
+
+    # Counts of one claim as columns, oldest first
+    def series(self, claim_id):
+        claim_id = bytes.fromhex(claim_id)
+        timestamps = array("q")
+        viewCounts = array("q")
+        likeCounts = array("i")
+        dislikeCounts = array("i")
+        for timestamp, record_claim_id, viewCount, likeCount, dislikeCount in RECORD.iter_unpack(self.data):
+            if record_claim_id == claim_id:
+                timestamps.append(timestamp)
+                viewCounts.append(viewCount)
+                likeCounts.append(likeCount)
+                dislikeCounts.append(dislikeCount)
+
+        return {"timestamp": timestamps, "viewCount": viewCounts, "likeCount": likeCounts, "dislikeCount": dislikeCounts}
+
+    def close(self):
+        self.data.release()
+        self.map.close()
+        self.file.close()
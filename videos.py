@@ -2,8 +2,21 @@
 
 from datetime import datetime
 import dateutil.parser
-import os, sys, threading
-import requests, json
+import os, sys, threading, time
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+from httpclient import HttpClient
+from prefetch import PagePrefetcher
+from claimshards import ShardedClaimLister
+from statestore import StateStore
+from timeseries import TimeSeriesWriter
+from exporters import openExporters
+from cassette import openCassette
+from metrics import Metrics
+from profiling import Profiler
+import sqlite3
 from zoneinfo import ZoneInfo
 
 # Add return value from thread functionnality, see solutions : https://stackoverflow.com/questions/6893968/how-to-get-the-return-value-from-a-thread
@@ -12,33 +25,89 @@ class ThreadWithReturnValue(threading.Thread):
                  args=(), kwargs={}):
         threading.Thread.__init__(self, group, target, name, args, kwargs)
         self._return = None 
+        self._exception = None
 
     def run(self):
         try:
             if self._target:
                 self._return = self._target(*self._args, **self._kwargs)
+        except BaseException as e:
+            # Errors (including exitProgram's SystemExit) are raised again by join in the calling thread
+            self._exception = e
         finally:
             del self._target, self._args, self._kwargs
 
+    def join(self, timeout=None):
+        threading.Thread.join(self, timeout)
+        if self._exception is not None:
+            raise self._exception
+
+# exitProgram called by a call of the async engine, a task ending with SystemExit would stop the event loop before other tasks are cancelled
+class ProgramExited(Exception):
+    pass
+
+# Fields of the records of outputFormats, one record per claim
+CLAIM_FIELDS = ["claim_id", "url", "claim_type", "release_time", "date", "title", "description", "duration", "viewCount", "likeCount", "dislikeCount", "commentCount", "reposted_claim_id"]
+
 class Program():
-    def __init__(self, idchannel, handlechannel, getThumbnail, tz, dateFormats):
+    def __init__(self, idchannel, handlechannel, getThumbnail, tz, dateFormats, useAsync=False, concurrency=20, viewCountBatchSize=50, client=None, prefetchPages=2, shardClaims=False, shardWorkers=4, exitProcess=True, stateStoreFile=None, watchInterval=None, watchPolls=None, outputFormats=(), cassette=None, writeMetrics=False, profile=False):
         self.idchannel = idchannel
         self.handlechannel = handlechannel
         self.getThumbnail = getThumbnail
+        self.useAsync = useAsync
+        self.concurrency = concurrency
+        self.viewCountBatchSize = viewCountBatchSize
+        self.prefetchPages = prefetchPages
+        self.shardClaims = shardClaims
+        self.shardWorkers = shardWorkers
+        self.exitProcess = exitProcess
+        self.watchInterval = watchInterval
+        self.watchPolls = watchPolls
+        self.outputFormats = outputFormats
+        self.writeMetrics = writeMetrics
+        self.profile = profile
+        # Phases are only profiled once main started the profiler, when profile is True
+        self.profiler = Profiler()
+        # Reentrant, exitProgram writes in the log file while holding it
+        self.exitLock = threading.RLock()
+        self.exited = False
+        self.initClient(client, concurrency, cassette)
+        # Claims and their stats are also kept in a SQLite file when stateStoreFile is set
+        self.stateStore = StateStore(stateStoreFile) if stateStoreFile is not None else None
         self.tzinfo = ZoneInfo(tz)
         self.dateFormats = dateFormats
         
         self.initLoggingFile()
         self.initResultFile()
             
+    # client can be shared between several programs, otherwise a new one is created with a pool sized to the concurrency
+    # A shared client gives the program its own retry budgets (see HttpClient.share)
+    # cassette (see cassette.py) records the requests of the new client, or replays recorded ones
+    # Requests of a shared client are counted in the metrics of the client owner (eg. batch.py), the program only keeps its phases
+    def initClient(self, client, poolSize, cassette=None):
+        self.ownClient = client is None
+        self.client = HttpClient(poolSize, cassette=cassette) if client is None else client.share()
+        self.metrics = self.client.metrics if self.ownClient is True else Metrics()
+
     def initLoggingFile(self):
         loggingfilename = "videosstats_" + self.idchannel
         self.loggingfile = open(loggingfilename + ".log", "a", encoding="utf-8")
     
     def initResultFile(self):
+        # Watch mode only appends to the time series file
+        if self.watchInterval is not None:
+            self.resultfile = None
+            self.exporters = {}
+            self.timeseries = TimeSeriesWriter("videosstats_" + self.idchannel + ".ts")
+            self.resultbasename = "videosstats_" + self.idchannel
+            return
+
         dateNow = self.getDateNow()
         resultfilename = "videosstats_" + self.idchannel + "_" + dateNow['dateFileString'] +  ".txt"
+        self.resultbasename = resultfilename[:-len(".txt")]
         self.resultfile = open(resultfilename, "w", encoding="utf-8")
+        # Structured outputs next to the result file (eg. videosstats_<idchannel>_<date>.ndjson)
+        self.exporters = openExporters(resultfilename[:-len(".txt")], self.outputFormats, CLAIM_FIELDS)
     
     def getDateNow(self):
         timestamp_now = datetime.now().timestamp()
@@ -51,16 +120,24 @@ class Program():
         
         return dateNow
 
+    # Only dateString is needed, the other formats of getDateNow aren't computed for each line
+    # Once exitProgram closed the files, errors of calls still in flight aren't written
     def writelog(self, message):
-        dateNow = self.getDateNow()
-        self.loggingfile.write(dateNow["dateString"] + " : " + message + "\n")
-        # Write in real time
-        self.loggingfile.flush()
+        dateString = datetime.now(self.tzinfo).strftime(self.dateFormats['dateString'])
+        with self.exitLock:
+            if self.exited is True:
+                return
+            self.loggingfile.write(dateString + " : " + message + "\n")
+            # Write in real time
+            self.loggingfile.flush()
             
     def writeresult(self, message):
-        self.resultfile.write(message)
-        # Write in real time
-        #self.resultfile.flush()
+        with self.exitLock:
+            if self.exited is True:
+                return
+            self.resultfile.write(message)
+            # Write in real time
+            #self.resultfile.flush()
 
     def initChannel(self):
         # Get handle from idchannel
@@ -78,7 +155,7 @@ class Program():
         }
         print(channelInfosURL)
         try:
-            response = requests.post(channelInfosURL, json=data, headers=headers)
+            response = self.client.post(channelInfosURL, json=data, headers=headers)
             if response.status_code == 200:
                 channelInfosResponse = response.text
                 channel_json = json.loads(channelInfosResponse)       
@@ -105,81 +182,122 @@ class Program():
         self.urlchannel = 'https://www.odysee.com/@' + self.handlechannel
 
     # Used when errors/exceptions occured and when we want to exit right now
+    # With exitProcess False (batch mode), only this program is stopped and other programs of the process go on
+    # Calls still in flight fail at once, their own exitProgram only stops their thread
     def exitProgram(self):
-        self.writelog("Execution had errors")
-        self.writelog("Ending program")
-        self.clean()
+        with self.exitLock:
+            # Several threads can fail at once, files are cleaned up only once
+            if self.exited is False:
+                self.writelog("Execution had errors")
+                self.writelog("Ending program")
+                self.exited = True
+                self.client.stop()
+                self.clean()
+        if self.exitProcess is False:
+            raise SystemExit(1)
         #sys.exit(1)
         os._exit(1)
     
     # Used at the end of program without errors/exceptions and when errors/exception occured
     def clean(self):
         try:
+            # Metrics of the run (see metrics.py) next to the result file, eg. videosstats_<idchannel>_<date>.metrics.json and .prom
+            if self.writeMetrics is True:
+                self.metrics.write(self.resultbasename)
+            # CPU and allocations of each phase (see profiling.py), eg. videosstats_<idchannel>_<date>.profile.txt
+            if self.profile is True:
+                self.profiler.stop()
+                self.profiler.write(self.resultbasename)
             # Close Files
             self.loggingfile.close()
-            self.resultfile.close()
+            if self.resultfile is not None:
+                self.resultfile.close()
+                for exporter in self.exporters.values():
+                    exporter.close()
+            else:
+                self.timeseries.close()
+            if self.stateStore is not None:
+                self.stateStore.close()
+            # Close connections only if the client isn't shared with other programs
+            if self.ownClient is True:
+                self.client.close()
         except Exception as e:
             print("Error cleaning up : " + str(e))
 
     def getViewCount(self, auth_token, claim_id):
-        viewCount = None
+        return self.getViewCountsBatch(auth_token, [claim_id])[0]
+
+    # view_count accepts a comma-separated list of claim_ids and returns an array of view counts in the same order
+    def getViewCountsBatch(self, auth_token, claim_ids):
+        viewCounts = None
         
         viewcountURL = 'https://api.odysee.com/file/view_count'
         headers = {"Origin": "https://odysee.com", "Referer": "https://odysee.com"}
-        data = {"auth_token": auth_token, "claim_id": claim_id}
+        data = {"auth_token": auth_token, "claim_id": ",".join(claim_ids)}
         try:
-            response = requests.post(viewcountURL, data=data, headers=headers)
+            response = self.client.post(viewcountURL, data=data, headers=headers)
             if response.status_code == 200:
                 viewcountResponse = response.text
                 viewcount_json = json.loads(viewcountResponse)
 
-                if viewcount_json["success"]:
-                    viewCount = viewcount_json["data"][0]
+                if viewcount_json["success"] and len(viewcount_json["data"]) == len(claim_ids):
+                    viewCounts = viewcount_json["data"]
+                elif viewcount_json["success"]:
+                    print(f"[×] claim_id={data['claim_id']} Error getting view_count viewcountURL={viewcountURL} data={data} : {len(viewcount_json['data'])} view counts for {len(claim_ids)} claims")
+                    self.writelog(f"[×] claim_id={data['claim_id']} Error getting view_count viewcountURL={viewcountURL} data={data} : {len(viewcount_json['data'])} view counts for {len(claim_ids)} claims")
+                    self.exitProgram()
                 else:
-                    print(f"[×] claim_id={claim_id} Error getting view_count viewcountURL={viewcountURL} data={data} : {viewcount_json['error']}")
-                    self.writelog(f"[×] claim_id={claim_id} Error getting view_count viewcountURL={viewcountURL} data={data} : {viewcount_json['error']}")
+                    print(f"[×] claim_id={data['claim_id']} Error getting view_count viewcountURL={viewcountURL} data={data} : {viewcount_json['error']}")
+                    self.writelog(f"[×] claim_id={data['claim_id']} Error getting view_count viewcountURL={viewcountURL} data={data} : {viewcount_json['error']}")
                     self.exitProgram()                    
             else:
-                print(f"[×] claim_id={claim_id} Response of viewcountURL {viewcountURL} isn't OK : {response.status_code} {response.text}")
-                self.writelog(f"[×] claim_id={claim_id} Response of viewcountURL {viewcountURL} isn't OK : {response.status_code} {response.text}")
+                print(f"[×] claim_id={data['claim_id']} Response of viewcountURL {viewcountURL} isn't OK : {response.status_code} {response.text}")
+                self.writelog(f"[×] claim_id={data['claim_id']} Response of viewcountURL {viewcountURL} isn't OK : {response.status_code} {response.text}")
                 self.exitProgram()
                 
         except Exception as e:
-            print(f"[×] claim_id={claim_id} Error viewcountURL {viewcountURL} : {e}")
-            self.writelog(f"[×] claim_id={claim_id} Error viewcountURL {viewcountURL} : {e}")
+            print(f"[×] claim_id={data['claim_id']} Error viewcountURL {viewcountURL} : {e}")
+            self.writelog(f"[×] claim_id={data['claim_id']} Error viewcountURL {viewcountURL} : {e}")
             self.exitProgram()
             
-        return viewCount
+        return viewCounts
 
     def getReactions(self, auth_token, claim_id):
-        reactions = {"likeCount": None, "dislikeCount": None}
+        return self.getReactionsBatch(auth_token, [claim_id])[claim_id]
+
+    # reaction/list accepts a comma-separated list of claim_ids, so reactions of a whole claim_search page are fetched at once
+    def getReactionsBatch(self, auth_token, claim_ids):
+        reactionsByClaim = {}
         
         reactionsURL = 'https://api.odysee.com/reaction/list'
         headers = {"Origin": "https://odysee.com", "Referer": "https://odysee.com"}
-        data = {"auth_token": auth_token, "claim_ids": claim_id}
+        data = {"auth_token": auth_token, "claim_ids": ",".join(claim_ids)}
         try:
-            response = requests.post(reactionsURL, data=data, headers=headers)
+            response = self.client.post(reactionsURL, data=data, headers=headers)
             if response.status_code == 200:
                 reactionsResponse = response.text
                 reactions_json = json.loads(reactionsResponse)
 
                 if reactions_json["success"]:
-                    reactions['likeCount'] = reactions_json["data"]["others_reactions"][claim_id]["like"]
-                    reactions['dislikeCount'] = reactions_json["data"]["others_reactions"][claim_id]["dislike"]
+                    others_reactions = reactions_json["data"]["others_reactions"]
+                    for claim_id in claim_ids:
+                        # claim_id missing from others_reactions leaves counts unknown
+                        claimReactions = others_reactions.get(claim_id, {})
+                        reactionsByClaim[claim_id] = {"likeCount": claimReactions.get("like"), "dislikeCount": claimReactions.get("dislike")}
                 else:
-                    print(f"[×] claim_id={claim_id} Error getting reaction/list reactionsURL={reactionsURL} data={data} : {reactions_json['error']}")
-                    self.writelog(f"[×] claim_id={claim_id} Error getting view_count reactionsURL={reactionsURL} data={data} : {reactions_json['error']}")
+                    print(f"[×] claim_ids={data['claim_ids']} Error getting reaction/list reactionsURL={reactionsURL} data={data} : {reactions_json['error']}")
+                    self.writelog(f"[×] claim_ids={data['claim_ids']} Error getting reaction/list reactionsURL={reactionsURL} data={data} : {reactions_json['error']}")
                     self.exitProgram()                                        
             else:
-                print(f"[×] claim_id={claim_id} Response of reactionsURL {reactionsURL} isn't OK : {response.status_code} {response.text}")
-                self.writelog(f"[×] claim_id={claim_id} Response of reactionsURL {reactionsURL} isn't OK : {response.status_code} {response.text}")
+                print(f"[×] claim_ids={data['claim_ids']} Response of reactionsURL {reactionsURL} isn't OK : {response.status_code} {response.text}")
+                self.writelog(f"[×] claim_ids={data['claim_ids']} Response of reactionsURL {reactionsURL} isn't OK : {response.status_code} {response.text}")
                 self.exitProgram()
         except Exception as e:
-            print(f"[×] claim_id={claim_id} Error reactionsURL {reactionsURL} : {e}")
-            self.writelog(f"[×] claim_id={claim_id} Error reactionsURL {reactionsURL} : {e}")
+            print(f"[×] claim_ids={data['claim_ids']} Error reactionsURL {reactionsURL} : {e}")
+            self.writelog(f"[×] claim_ids={data['claim_ids']} Error reactionsURL {reactionsURL} : {e}")
             self.exitProgram()
 
-        return reactions
+        return reactionsByClaim
 
     def getCommentsCount(self, claim_id):
         commentCount = None
@@ -199,7 +317,7 @@ class Program():
               }
         }
         try:
-            response = requests.post(commentsURL, json=data, headers=headers)
+            response = self.client.post(commentsURL, json=data, headers=headers)
             if response.status_code == 200:
                 commentsResponse = response.text
                 comments_json = json.loads(commentsResponse)
@@ -222,39 +340,35 @@ class Program():
 
         return commentCount
     
-    def main(self):
-        print("Starting program")
-        self.writelog("Starting program")
-        self.initChannel()
-
-        self.writeresult("Channel " + self.urlchannel + " id : " + self.idchannel)
-        self.writeresult("\n\n")
-        
-        # Get auth_token
+    def getAuthToken(self):
         auth_token = None
         auth_tokenURL = 'https://api.odysee.com/user/new'
         headers = {"Content-Type": "application/json-rpc", "Origin": "https://odysee.com", "Referer": "https://odysee.com"}
         try:
-            response = requests.post(auth_tokenURL, headers=headers)
+            response = self.client.post(auth_tokenURL, headers=headers)
             if response.status_code == 200:
                 auth_tokenResponse = response.text
                 auth_token_json = json.loads(auth_tokenResponse)
                 if auth_token_json["success"]:
                     auth_token = auth_token_json["data"]["auth_token"]
                 else:
-                    print(f"[×] Error getting auth_token auth_tokenURL={auth_tokenURL} data={data} : {auth_token_json['error']}")
-                    self.writelog(f"[×] Error getting auth_token auth_tokenURL={auth_tokenURL} data={data} : {auth_token_json['error']}")
+                    print(f"[×] Error getting auth_token auth_tokenURL={auth_tokenURL} : {auth_token_json['error']}")
+                    self.writelog(f"[×] Error getting auth_token auth_tokenURL={auth_tokenURL} : {auth_token_json['error']}")
                     self.exitProgram()
             else:
-                print(f"[×] claim_id={claim_id} Response of auth_tokenURL {auth_tokenURL} isn't OK : {response.status_code} {response.text}")
-                self.writelog(f"[×] claim_id={claim_id} Response of auth_tokenURL {auth_tokenURL} isn't OK : {response.status_code} {response.text}")
+                print(f"[×] Response of auth_tokenURL {auth_tokenURL} isn't OK : {response.status_code} {response.text}")
+                self.writelog(f"[×] Response of auth_tokenURL {auth_tokenURL} isn't OK : {response.status_code} {response.text}")
                 self.exitProgram()                
         except Exception as e:           
             print(f"[×] Error auth_tokenURL {auth_tokenURL} : {e}")
             self.writelog(f"[×] Error auth_tokenURL {auth_tokenURL} : {e}")
             self.exitProgram()
 
-        # Get all ressources of Content tab of Odysee channel
+        return auth_token
+
+    # Get one page of ressources of Content tab of Odysee channel
+    # release_time is a list of constraints (eg. [">=1600000000", "<1700000000"]) when claims are enumerated by shards
+    def getClaimsPage(self, page, release_time=None):
         claimsURL = 'https://api.na-backend.odysee.com/api/v1/proxy?m=claim_search'
         headers = {"Content-Type": "application/json-rpc", "Origin": "https://odysee.com", "Referer": "https://odysee.com"}
         dataClaimsURL = {
@@ -262,7 +376,7 @@ class Program():
             "method": "claim_search",
             "params": {
                 "page_size": 999, # automatically set to 50 in response
-                "page": 1,
+                "page": page,
                 "no_totals": False,
                 "order_by": [
                     "release_time"
@@ -272,166 +386,412 @@ class Program():
                 ]
             }
         }
+        if release_time is not None:
+            dataClaimsURL['params']['release_time'] = release_time
         print(claimsURL)
-        
-        page = 1
-        hasMorePages = True
-        while hasMorePages is True:
-            dataClaimsURL['params']['page'] = page       
-            try:
-                response = requests.post(claimsURL, json=dataClaimsURL, headers=headers)
-                if response.status_code == 200:
-                    claimsResponse = response.text
-                    claims_json = json.loads(claimsResponse)
-                    if 'error' in claims_json:
-                        print(f"[×] Error getting claims claimsURL={claimsURL} data={dataClaimsURL} : {claims_json['error']['message']}")
-                        self.writelog(f"[×] Error getting claims claimsURL={claimsURL} data={dataClaimsURL} : {claims_json['error']['message']}")
-                        self.exitProgram()
-                else:                   
-                    print(f"[×] Response of claimsURL {claimsURL} isn't OK : {response.status_code} {response.text}")
-                    self.writelog(f"[×] Response of claimsURL {claimsURL} isn't OK : {response.status_code} {response.text}")
+        try:
+            response = self.client.post(claimsURL, json=dataClaimsURL, headers=headers)
+            if response.status_code == 200:
+                claimsResponse = response.text
+                claims_json = json.loads(claimsResponse)
+                if 'error' in claims_json:
+                    print(f"[×] Error getting claims claimsURL={claimsURL} data={dataClaimsURL} : {claims_json['error']['message']}")
+                    self.writelog(f"[×] Error getting claims claimsURL={claimsURL} data={dataClaimsURL} : {claims_json['error']['message']}")
                     self.exitProgram()
-            except Exception as e:
-                print(f"[×] Error claimsURL {claimsURL} : {e}")
-                self.writelog(f"[×] Error claimsURL {claimsURL} : {e}")
+            else:                   
+                print(f"[×] Response of claimsURL {claimsURL} isn't OK : {response.status_code} {response.text}")
+                self.writelog(f"[×] Response of claimsURL {claimsURL} isn't OK : {response.status_code} {response.text}")
                 self.exitProgram()
-                
-            result = claims_json.get('result')
-            items = result.get('items')
-            total_pages = result.get('total_pages')
-
-            for item in items:
-                url = item.get('canonical_url').replace('lbry://@', 'https://odysee.com/@').replace('#', ':')
-                claim_id = item.get('claim_id')
-                print(url)
-                self.writeresult(url)
-                self.writeresult("\n")
-
-                if "release_time" not in item:
-                    release_time = item.get("timestamp")
-                else:
-                    release_time = item.get("release_time")
-
-                dateVideo_text = datetime.fromtimestamp(int(release_time), self.tzinfo).strftime(self.dateFormats['dateString'])
-
-                claim_type = item.get('value_type')
-                reposted_claim = item.get('reposted_claim')
-                if claim_type == 'repost':
-                    value = reposted_claim.get('value')
-                    claim_id_additionnalreq = reposted_claim.get('claim_id')
-                    title = value.get('title')
-                    description = value.get('description')
-                    duration = value.get('video').get('duration')
-                else:
-                    value = item.get('value')
-                    claim_id_additionnalreq = claim_id
-                    title = value.get('title')
-                    description = value.get('description')
-                    duration = value.get('video').get('duration')
-                
-                hours = duration // 3600
-                minutes = (duration % 3600) // 60
-                seconds = (duration % 3600) % 60
-                if hours > 0:
-                    durationString = '{:02d}H{:02d}M{:02d}S'.format(hours, minutes, seconds)
-                elif minutes > 0:
-                    durationString = '{:02d}M{:02d}S'.format(minutes, seconds)
-                else:
-                    durationString = '{:02d}S'.format(seconds)
-                
-                # If auth_token couldn't be retrieved, we don't get viewCount and like/dislikeCount
-                threads = []
-                if auth_token is not None:
-                    # View count
-                    threadGetViewCount = ThreadWithReturnValue(target=self.getViewCount, kwargs={"auth_token": auth_token, "claim_id": claim_id_additionnalreq})
-                    threadGetViewCount.start()
-                    threads.append(threadGetViewCount)
-
-                    # Like/dislike count
-                    threadGetReactions = ThreadWithReturnValue(target=self.getReactions, kwargs={"auth_token": auth_token, "claim_id": claim_id_additionnalreq})
-                    threadGetReactions.start()
-                    threads.append(threadGetReactions)
-                                                           
-                # Comment count
-                threadGetCommentsCount = ThreadWithReturnValue(target=self.getCommentsCount, kwargs={"claim_id": claim_id_additionnalreq})
-                threadGetCommentsCount.start()
-                threads.append(threadGetCommentsCount)
-
-                # Wait for threads to finish and store their returned value
-                for thread in threads:
-                    thread.join()
-
-                if auth_token is not None:
-                    viewCount = threadGetViewCount._return
-                    reactions = threadGetReactions._return
-                commentCount = threadGetCommentsCount._return                    
-
-                print("Date : " + dateVideo_text)
-                self.writeresult("Date : " + dateVideo_text)
-
-                if self.getThumbnail is True:
-                    thumbnail_url = value.get('thumbnail').get('url')
-                    try:
-                        response = requests.get(thumbnail_url, stream = True)
-                        if response.status_code == 200:
-                            thumbnailInfosResponse = response.content
-                            filethumbnail = claim_id + "_thumbnail_" + datetime.fromtimestamp(datetime.now().timestamp(), self.tzinfo).strftime(self.dateFormats['dateFileString']) + ".webp"
-                            fthumbnail = open(filethumbnail, "wb")
-                            fthumbnail.write(thumbnailInfosResponse)
-                            fthumbnail.close()
-                        else:
-                            print(f"[×] claim_id={claim_id_additionnalreq} Response of thumbnail_url {thumbnail_url} isn't OK : {response.status_code} {response.text}")
-                            self.writelog(f"[×] claim_id={claim_id_additionnalreq} Response of thumbnail_url {thumbnail_url} isn't OK : {response.status_code} {response.text}")
-                            self.exitProgram()
-                    except Exception as e:
-                        print(f"[×] Erreur thumbnail : {e}")
-                        print(f"[×] claim_id={claim_id_additionnalreq} Error thumbnail_url {thumbnail_url} : {e}")
-                        self.writelog(f"[×] claim_id={claim_id_additionnalreq} Error thumbnail_url {thumbnail_url} : {e}")
-                        self.exitProgram()                        
-
-                self.writeresult("\n")
-                print("Id : " + str(claim_id))
-                self.writeresult("Id : " + str(claim_id))
-                self.writeresult("\n")
-                print("Title : " + str(title))
-                self.writeresult("Title : " + str(title))
-                self.writeresult("\n")
-                print("Duration : " + str(durationString))
-                self.writeresult("Duration : " + str(durationString))
-                self.writeresult("\n")
-                print("Description : " + str(description))
-                self.writeresult("Description : " + str(description))
-                self.writeresult("\n")
-                print("Views : " + str(viewCount))
-                self.writeresult("Views : " + str(viewCount))
-                self.writeresult("\n")
-                print("Likes : " + str(reactions['likeCount']))
-                self.writeresult("Likes : " + str(reactions['likeCount']))
-                self.writeresult("\n")
-                print("Dislikes : " + str(reactions['dislikeCount']))
-                self.writeresult("Dislikes : " + str(reactions['dislikeCount']))
-                self.writeresult("\n")
-                print("Comments : " + str(commentCount))
-                self.writeresult("Comments : " + str(commentCount))
-                self.writeresult("\n")
-
-                if claim_type == 'repost':
-                    self.writeresult("\nOriginal content :\n")
-                    self.writeresult("URL : " + reposted_claim.get('canonical_url').replace('lbry://@', 'https://odysee.com/@').replace('#', ':'))
-                    self.writeresult("\n")
-                    self.writeresult("Id : " + reposted_claim.get('claim_id'))
-                    self.writeresult("\n")
-                    self.writeresult("Date original content : " + datetime.fromtimestamp(int(reposted_claim.get('timestamp')), self.tzinfo).strftime(self.dateFormats['dateString']))
-                    self.writeresult("\n")
-                    self.writeresult("Author : " + reposted_claim.get('signing_channel').get('canonical_url').replace('lbry://@', 'https://odysee.com/@').replace('#', ':') +
-                    " (" + reposted_claim.get('signing_channel').get('claim_id') + ")")
-                    self.writeresult("\n")
-
-                self.writeresult("\n")
-                
-            page = page + 1
-            if page > total_pages:
-                hasMorePages = False
+        except Exception as e:
+            print(f"[×] Error claimsURL {claimsURL} : {e}")
+            self.writelog(f"[×] Error claimsURL {claimsURL} : {e}")
+            self.exitProgram()
+
+        return claims_json.get('result')
+
+    # Extract informations of a claim_search item, for reposts the informations of original content are used
+    def getClaimInfos(self, item):
+        url = item.get('canonical_url').replace('lbry://@', 'https://odysee.com/@').replace('#', ':')
+        claim_id = item.get('claim_id')
+
+        if "release_time" not in item:
+            release_time = item.get("timestamp")
+        else:
+            release_time = item.get("release_time")
+
+        dateVideo_text = datetime.fromtimestamp(int(release_time), self.tzinfo).strftime(self.dateFormats['dateString'])
+
+        claim_type = item.get('value_type')
+        reposted_claim = item.get('reposted_claim')
+        if claim_type == 'repost':
+            value = reposted_claim.get('value')
+            claim_id_additionnalreq = reposted_claim.get('claim_id')
+            title = value.get('title')
+            description = value.get('description')
+            duration = value.get('video').get('duration')
+        else:
+            value = item.get('value')
+            claim_id_additionnalreq = claim_id
+            title = value.get('title')
+            description = value.get('description')
+            duration = value.get('video').get('duration')
+        
+        hours = duration // 3600
+        minutes = (duration % 3600) // 60
+        seconds = (duration % 3600) % 60
+        if hours > 0:
+            durationString = '{:02d}H{:02d}M{:02d}S'.format(hours, minutes, seconds)
+        elif minutes > 0:
+            durationString = '{:02d}M{:02d}S'.format(minutes, seconds)
+        else:
+            durationString = '{:02d}S'.format(seconds)
+
+        reposted_timestamp = reposted_claim.get('timestamp') if claim_type == 'repost' else None
+
+        claimInfos = {
+            "url": url,
+            "claim_id": claim_id,
+            "claim_id_additionnalreq": claim_id_additionnalreq,
+            "claim_type": claim_type,
+            "reposted_claim": reposted_claim,
+            "value": value,
+            "dateVideo_text": dateVideo_text,
+            "title": title,
+            "description": description,
+            "durationString": durationString,
+            "duration": duration,
+            "release_time": int(release_time),
+            "timestamp": item.get('timestamp'),
+            "reposted_timestamp": reposted_timestamp
+        }
+
+        return claimInfos
+
+    # viewCount and like/dislikeCount of every claim of a page (reposted originals included)
+    # reaction/list is called once for the page while view_count is called by chunks of viewCountBatchSize claims
+    def getPageStats(self, auth_token, claimsInfos):
+        noReactions = {"likeCount": None, "dislikeCount": None}
+        viewCounts = {}
+        reactionsByClaim = {}
+
+        # If auth_token couldn't be retrieved, we don't get viewCount and like/dislikeCount
+        claim_ids = list(dict.fromkeys(claimInfos['claim_id_additionnalreq'] for claimInfos in claimsInfos))
+        if auth_token is not None and len(claim_ids) > 0:
+            # Like/dislike count
+            threadGetReactions = ThreadWithReturnValue(target=self.getReactionsBatch, kwargs={"auth_token": auth_token, "claim_ids": claim_ids})
+            threadGetReactions.start()
+
+            # View count
+            for start in range(0, len(claim_ids), self.viewCountBatchSize):
+                chunk = claim_ids[start:start + self.viewCountBatchSize]
+                viewCounts.update(zip(chunk, self.getViewCountsBatch(auth_token, chunk)))
+
+            threadGetReactions.join()
+            reactionsByClaim = threadGetReactions._return
+
+        pageStats = []
+        for claimInfos in claimsInfos:
+            claim_id = claimInfos['claim_id_additionnalreq']
+            pageStats.append({"viewCount": viewCounts.get(claim_id), "reactions": reactionsByClaim.get(claim_id, noReactions), "commentCount": None})
+
+        return pageStats
+
+    def downloadThumbnail(self, claimInfos):
+        claim_id = claimInfos['claim_id']
+        claim_id_additionnalreq = claimInfos['claim_id_additionnalreq']
+        thumbnail_url = claimInfos['value'].get('thumbnail').get('url')
+        try:
+            response = self.client.get(thumbnail_url, stream = True)
+            if response.status_code == 200:
+                thumbnailInfosResponse = response.content
+                filethumbnail = claim_id + "_thumbnail_" + datetime.fromtimestamp(datetime.now().timestamp(), self.tzinfo).strftime(self.dateFormats['dateFileString']) + ".webp"
+                fthumbnail = open(filethumbnail, "wb")
+                fthumbnail.write(thumbnailInfosResponse)
+                fthumbnail.close()
+            else:
+                print(f"[×] claim_id={claim_id_additionnalreq} Response of thumbnail_url {thumbnail_url} isn't OK : {response.status_code} {response.text}")
+                self.writelog(f"[×] claim_id={claim_id_additionnalreq} Response of thumbnail_url {thumbnail_url} isn't OK : {response.status_code} {response.text}")
+                self.exitProgram()
+        except Exception as e:
+            print(f"[×] Erreur thumbnail : {e}")
+            print(f"[×] claim_id={claim_id_additionnalreq} Error thumbnail_url {thumbnail_url} : {e}")
+            self.writelog(f"[×] claim_id={claim_id_additionnalreq} Error thumbnail_url {thumbnail_url} : {e}")
+            self.exitProgram()                        
+
+    def writeClaim(self, claimInfos, stats):
+        url = claimInfos['url']
+        claim_id = claimInfos['claim_id']
+        reposted_claim = claimInfos['reposted_claim']
+        reactions = stats['reactions']
+
+        print(url)
+        self.writeresult(url)
+        self.writeresult("\n")
+        print("Date : " + claimInfos['dateVideo_text'])
+        self.writeresult("Date : " + claimInfos['dateVideo_text'])
+        self.writeresult("\n")
+        print("Id : " + str(claim_id))
+        self.writeresult("Id : " + str(claim_id))
+        self.writeresult("\n")
+        print("Title : " + str(claimInfos['title']))
+        self.writeresult("Title : " + str(claimInfos['title']))
+        self.writeresult("\n")
+        print("Duration : " + str(claimInfos['durationString']))
+        self.writeresult("Duration : " + str(claimInfos['durationString']))
+        self.writeresult("\n")
+        print("Description : " + str(claimInfos['description']))
+        self.writeresult("Description : " + str(claimInfos['description']))
+        self.writeresult("\n")
+        print("Views : " + str(stats['viewCount']))
+        self.writeresult("Views : " + str(stats['viewCount']))
+        self.writeresult("\n")
+        print("Likes : " + str(reactions['likeCount']))
+        self.writeresult("Likes : " + str(reactions['likeCount']))
+        self.writeresult("\n")
+        print("Dislikes : " + str(reactions['dislikeCount']))
+        self.writeresult("Dislikes : " + str(reactions['dislikeCount']))
+        self.writeresult("\n")
+        print("Comments : " + str(stats['commentCount']))
+        self.writeresult("Comments : " + str(stats['commentCount']))
+        self.writeresult("\n")
+
+        if claimInfos['claim_type'] == 'repost':
+            self.writeresult("\nOriginal content :\n")
+            self.writeresult("URL : " + reposted_claim.get('canonical_url').replace('lbry://@', 'https://odysee.com/@').replace('#', ':'))
+            self.writeresult("\n")
+            self.writeresult("Id : " + reposted_claim.get('claim_id'))
+            self.writeresult("\n")
+            self.writeresult("Date original content : " + datetime.fromtimestamp(int(reposted_claim.get('timestamp')), self.tzinfo).strftime(self.dateFormats['dateString']))
+            self.writeresult("\n")
+            self.writeresult("Author : " + reposted_claim.get('signing_channel').get('canonical_url').replace('lbry://@', 'https://odysee.com/@').replace('#', ':') +
+            " (" + reposted_claim.get('signing_channel').get('claim_id') + ")")
+            self.writeresult("\n")
+
+        self.writeresult("\n")
+
+        if self.exporters:
+            record = {
+                "claim_id": claim_id,
+                "url": url,
+                "claim_type": claimInfos['claim_type'],
+                "release_time": claimInfos['release_time'],
+                "date": claimInfos['dateVideo_text'],
+                "title": claimInfos['title'],
+                "description": claimInfos['description'],
+                "duration": claimInfos['duration'],
+                "viewCount": stats['viewCount'],
+                "likeCount": reactions['likeCount'],
+                "dislikeCount": reactions['dislikeCount'],
+                "commentCount": stats['commentCount'],
+                "reposted_claim_id": reposted_claim.get('claim_id') if claimInfos['claim_type'] == 'repost' else None
+            }
+            for exporter in self.exporters.values():
+                exporter.write(record)
+
+    # Claims whose metadata must be handled again (thumbnail downloaded, metadata stored), all claims without a state store
+    def getChangedClaims(self, claimsInfos):
+        if self.stateStore is None:
+            return {claimInfos['claim_id'] for claimInfos in claimsInfos}
+
+        try:
+            return self.stateStore.changedClaims(claimsInfos)
+        except sqlite3.Error as e:
+            print(f"[×] Error reading state store {self.stateStore.filename} : {e}")
+            self.writelog(f"[×] Error reading state store {self.stateStore.filename} : {e}")
+            self.exitProgram()
+
+    # Claims of a page and their stats are written in the state store in one transaction
+    def storePage(self, claimsInfos, pageStats, changed):
+        if self.stateStore is None:
+            return
+
+        try:
+            self.stateStore.writePage(self.idchannel, claimsInfos, pageStats, changed)
+        except sqlite3.Error as e:
+            print(f"[×] Error writing state store {self.stateStore.filename} : {e}")
+            self.writelog(f"[×] Error writing state store {self.stateStore.filename} : {e}")
+            self.exitProgram()
+
+    # Handle claims one after the other, viewCount and like/dislikeCount are fetched once per page
+    # Next claim_search pages are fetched in background while claims are handled
+    def exportClaims(self, auth_token):
+        for result in self.profiler.iterate("listing", self.getClaimsPages()):
+            with self.profiler.phase("listing"):
+                claimsInfos = [self.getClaimInfos(item) for item in result.get('items')]
+                changed = self.getChangedClaims(claimsInfos)
+            with self.profiler.phase("stats"):
+                pageStats = self.getPageStats(auth_token, claimsInfos)
+
+            for claimInfos, stats in zip(claimsInfos, pageStats):
+                with self.profiler.phase("stats"):
+                    stats['commentCount'] = self.getCommentsCount(claimInfos['claim_id_additionnalreq'])
+
+                    # Thumbnails of claims not updated since the last stored run are already downloaded
+                    if self.getThumbnail is True and claimInfos['claim_id'] in changed:
+                        self.downloadThumbnail(claimInfos)
+
+                with self.profiler.phase("write"):
+                    self.writeClaim(claimInfos, stats)
+                self.metrics.addItems("export", "claims")
+
+            with self.profiler.phase("write"):
+                self.storePage(claimsInfos, pageStats, changed)
+
+    # Handle all claims of a claim_search page, and of the next page, at once
+    # Blocking calls run in a thread pool, self.concurrency bounds the number of calls in flight
+    # Stats are fetched by the thread pool, only listing and write phases of the event loop thread are profiled
+    async def exportClaimsAsync(self, auth_token):
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+        async def run(func, *args):
+            async with semaphore:
+                try:
+                    return await loop.run_in_executor(executor, func, *args)
+                except SystemExit:
+                    raise ProgramExited()
+
+        async def handleClaim(claimInfos, pageStatsTask, num, changed):
+            calls = [run(self.getCommentsCount, claimInfos['claim_id_additionnalreq'])]
+            if self.getThumbnail is True and claimInfos['claim_id'] in changed:
+                calls.append(run(self.downloadThumbnail, claimInfos))
+            results = await asyncio.gather(*calls)
+
+            stats = (await pageStatsTask)[num]
+            stats['commentCount'] = results[0]
+
+            return stats
+
+        # claim_search pages are fetched in background, waiting for the next one doesn't take a slot of the semaphore
+        pages = iter(self.getClaimsPages())
+
+        # Claims of the oldest pending page are written in order while claims of the next page are fetched
+        pendingPages = deque()
+        pageTask = loop.run_in_executor(None, next, pages, None)
+        try:
+            while pageTask is not None or pendingPages:
+                if pageTask is not None and len(pendingPages) < 2:
+                    result = await pageTask
+                    if result is None:
+                        pageTask = None
+                        continue
+
+                    with self.profiler.phase("listing"):
+                        claimsInfos = [self.getClaimInfos(item) for item in result.get('items')]
+                        changed = self.getChangedClaims(claimsInfos)
+                    pageStatsTask = asyncio.ensure_future(run(self.getPageStats, auth_token, claimsInfos))
+                    claims = []
+                    for num, claimInfos in enumerate(claimsInfos):
+                        claims.append((claimInfos, asyncio.ensure_future(handleClaim(claimInfos, pageStatsTask, num, changed))))
+                    pendingPages.append((claims, changed, pageStatsTask))
+
+                    pageTask = loop.run_in_executor(None, next, pages, None)
+                    continue
+
+                # The page stays pending until it is written, so its tasks are cancelled on failure
+                claims, changed, pageStatsTask = pendingPages[0]
+                pageStats = []
+                for claimInfos, claimTask in claims:
+                    stats = await claimTask
+                    # A later claim failed meanwhile, exitProgram already closed the result file
+                    if self.exited is True:
+                        raise ProgramExited()
+                    with self.profiler.phase("write"):
+                        self.writeClaim(claimInfos, stats)
+                    self.metrics.addItems("export", "claims")
+                    pageStats.append(stats)
+
+                with self.profiler.phase("write"):
+                    self.storePage([claimInfos for claimInfos, claimTask in claims], pageStats, changed)
+                pendingPages.popleft()
+        except ProgramExited:
+            self.exitProgram()
+        finally:
+            # On the first failure, claims in flight are abandoned and their errors are retrieved
+            tasks = []
+            for claims, changed, pageStatsTask in pendingPages:
+                tasks.append(pageStatsTask)
+                tasks.extend(claimTask for claimInfos, claimTask in claims)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # The page being listed is waited for rather than cancelled, its thread would go on listing
+            # It ends quickly once exitProgram stopped the client, then the lister can be stopped
+            if pageTask is not None:
+                await asyncio.gather(pageTask, return_exceptions=True)
+            pages.close()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    # claim_search pages of the channel, fetched ahead of the claims being handled
+    # With shardClaims, pages come from release_time ranges fetched in parallel, for channels with tens of thousands of claims
+    def getClaimsPages(self):
+        if self.shardClaims is True:
+            return ShardedClaimLister(self.getClaimsPage, self.shardWorkers, onError=self.exitProgram)
+
+        return PagePrefetcher(self.getClaimsPage, self.prefetchPages, onError=self.exitProgram)
+
+    # Poll viewCount and like/dislikeCount of all claims every watchInterval seconds, samples of a poll are appended to the time series file at once
+    # Stops after watchPolls polls, or never when watchPolls is None
+    def watch(self, auth_token):
+        polls = 0
+        while self.watchPolls is None or polls < self.watchPolls:
+            pollStart = time.monotonic()
+            timestamp = int(time.time())
+            samples = []
+            for result in self.getClaimsPages():
+                claimsInfos = [self.getClaimInfos(item) for item in result.get('items')]
+                pageStats = self.getPageStats(auth_token, claimsInfos)
+                for claimInfos, stats in zip(claimsInfos, pageStats):
+                    reactions = stats['reactions']
+                    samples.append((claimInfos['claim_id'], stats['viewCount'], reactions['likeCount'], reactions['dislikeCount']))
+
+            self.timeseries.append(timestamp, samples)
+            self.metrics.addItems("watch", "samples", len(samples))
+            polls = polls + 1
+            print(f"Poll {polls} : {len(samples)} claims")
+            self.writelog(f"Poll {polls} : {len(samples)} claims")
+
+            if self.watchPolls is not None and polls >= self.watchPolls:
+                break
+            # Polls start every watchInterval seconds, whatever their duration
+            time.sleep(max(0, self.watchInterval - (time.monotonic() - pollStart)))
+
+    def main(self):
+        print("Starting program")
+        self.writelog("Starting program")
+        if self.profile is True:
+            self.profiler.start()
+        self.metrics.startPhase("init")
+        self.initChannel()
+
+        if self.watchInterval is not None:
+            auth_token = self.getAuthToken()
+            self.metrics.endPhase("init")
+            self.metrics.startPhase("watch")
+            try:
+                self.watch(auth_token)
+            except KeyboardInterrupt:
+                print("Watch stopped")
+                self.writelog("Watch stopped")
+            self.metrics.endPhase("watch")
+            print("Ending program")
+            self.writelog("Ending program")
+            self.clean()
+            return
+
+        self.writeresult("Channel " + self.urlchannel + " id : " + self.idchannel)
+        self.writeresult("\n\n")
+        
+        auth_token = self.getAuthToken()
+        self.metrics.endPhase("init")
+
+        self.metrics.startPhase("export")
+        if self.useAsync is True:
+            asyncio.run(self.exportClaimsAsync(auth_token))
+        else:
+            self.exportClaims(auth_token)
+        self.metrics.endPhase("export")
 
         print("Execution was OK")
         self.writelog("Execution was OK")
@@ -445,11 +805,38 @@ if __name__ == "__main__":
     idchannel = '' # idchannel is "Claim ID" value on About page of channel
     getThumbnail = False
 
+    # Engine
+    useAsync = False # True to fetch stats of all claims of a page (and of the next page) at once
+    concurrency = 20 # Maximum number of requests in flight when useAsync is True
+    viewCountBatchSize = 50 # Number of claims asked in one view_count call
+    prefetchPages = 2 # Number of claim_search pages fetched ahead of the claims being handled
+    shardClaims = False # True to list claims by release_time ranges fetched in parallel (channels with tens of thousands of claims)
+    shardWorkers = 4 # Number of release_time ranges fetched in parallel when shardClaims is True
+
+    # State store
+    stateStoreFile = None # eg. "videosstats.sqlite" to keep claims and their stats of each run, thumbnails are then downloaded only for new or updated claims
+
+    # Watch mode
+    watchInterval = None # eg. 3600 to poll viewCount and like/dislikeCount every hour into videosstats_<idchannel>.ts, instead of writing a result file
+    watchPolls = None # Number of polls before stopping, None to poll until interrupted
+
+    # Structured outputs
+    outputFormats = [] # eg. ["ndjson", "csv"] to also write one record per claim next to the result file
+
+    # Cassette
+    cassetteFile = None # eg. "videosstats.cassette.gz" to record requests and responses of the run, or to replay them without network
+    cassetteMode = "record" # "record" or "replay"
+    latencyScale = 1.0 # Replayed responses wait their recorded latency multiplied by latencyScale, 0 to not wait
+
+    # Metrics
+    writeMetrics = False # True to write requests by endpoint (statuses, bytes, retries, latency) and throughput of each phase in videosstats_<idchannel>_<date>.metrics.json and .prom
+    profile = False # True to profile CPU (cProfile) and allocations (tracemalloc) of listing, stats and write phases in videosstats_<idchannel>_<date>.profile.txt, slows the export down
+
     # Format
     tz = "Europe/Paris"
     dateFormats = {"dateString": "%d/%m/%Y %H:%M:%S", "dateDBString": "%Y-%m-%d %H:%M:%S", "dateFileString": "%d%m%Y%H%M%S"}
     
     # Launch
-    program = Program(idchannel, handlechannel, getThumbnail, tz, dateFormats)
+    program = Program(idchannel, handlechannel, getThumbnail, tz, dateFormats, useAsync, concurrency, viewCountBatchSize, prefetchPages=prefetchPages, shardClaims=shardClaims, shardWorkers=shardWorkers, stateStoreFile=stateStoreFile, watchInterval=watchInterval, watchPolls=watchPolls, outputFormats=outputFormats, cassette=openCassette(cassetteFile, cassetteMode, latencyScale) if cassetteFile is not None else None, writeMetrics=writeMetrics, profile=profile)
     program.main()
 